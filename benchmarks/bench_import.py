@@ -0,0 +1,79 @@
+"""
+Usage:
+  bench_import.py [--budget <seconds>] [--repeats <n>]
+
+  bench_import.py (-h | --help)
+
+Measures the import time of the solver core (the modules imported by
+main.py and gettimes.py) in fresh interpreters, and checks that it stays
+within the budget. It also checks that the core does not import matplotlib
+or pandas, which are only needed to draw the chart and to read CSV
+instances. Exits with status 1 if any check fails.
+
+Options:
+  --budget <arg>            Maximum import time, in seconds [default: 0.5].
+
+  --repeats <arg>           Fresh interpreters started. The best time is
+                            kept [default: 5].
+
+  -h --help                 Produce help message.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import docopt
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+CORE_MODULES = ["main", "gettimes", "crp_brkga", "crp_decoder",
+                "crp_parallel", "crp_instance", "crp_workspace", "crp_cache",
+                "crp_stats", "crp_checkpoint", "crp_trace", "crp_solution",
+                "crp_islands"]
+
+HEAVY_MODULES = ["matplotlib", "pandas"]
+
+# Runs in the fresh interpreter: imports the core and reports the time and
+# which heavy modules got loaded.
+PROBE = f"""
+import json, sys, time
+start_time = time.perf_counter()
+for name in {CORE_MODULES!r}:
+    __import__(name)
+elapsed = time.perf_counter() - start_time
+print(json.dumps({{"time": elapsed,
+                  "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+###############################################################################
+
+def measure() -> dict:
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+###############################################################################
+
+def main() -> None:
+    args = docopt.docopt(__doc__)
+    budget = float(args["--budget"])
+    repeats = int(args["--repeats"])
+
+    results = [measure() for _ in range(repeats)]
+    best = min(result["time"] for result in results)
+    heavy = sorted({m for result in results for m in result["heavy"]})
+
+    print(f"Core import time: {best * 1e3:.1f} ms "
+          f"(budget {budget * 1e3:.0f} ms)")
+    print(f"Heavy modules imported: {', '.join(heavy) or 'none'}")
+
+    if best > budget or heavy:
+        print("Import budget exceeded.")
+        sys.exit(1)
+
+###############################################################################
+
+if __name__ == "__main__":
+    main()
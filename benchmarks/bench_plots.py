@@ -0,0 +1,80 @@
+"""
+Usage:
+  bench_plots.py [-i <instance_file>] [-p <plots>] [-n <chromosomes>] \
+[-s <seed>]
+
+  bench_plots.py (-h | --help)
+
+Measures how the decoding time grows with the number of plots. For each
+number of plots, decodes a batch of random chromosomes and reports the time
+per decode and per plot. The last line is the slope of log(time) against
+log(plots), which is close to 1 when the decoder scales linearly.
+
+Options:
+  -i --instance_file <arg>  Instance file [default: dados-ipo].
+
+  -p --plots <arg>          Comma-separated numbers of plots
+                            [default: 1,10,50,100,200,400].
+
+  -n --num_chromosomes <arg>  Chromosomes decoded for each number of plots
+                              [default: 20].
+
+  -s --seed <arg>           Seed for the random chromosomes [default: 0].
+
+  -h --help                 Produce help message.
+"""
+
+import os
+import sys
+import time
+
+import docopt
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from crp_instance import CrpInstance
+from crp_decoder import CrpDecoder
+
+###############################################################################
+
+def time_decodes(instance: CrpInstance, num_chromosomes: int,
+                 rng: np.random.Generator) -> float:
+    """
+    Returns the mean time, in seconds, to decode one random chromosome.
+    """
+    decoder = CrpDecoder(instance)
+    chromosomes = rng.random((num_chromosomes, instance.num_nodes))
+    decoder.decode(chromosomes[0], rewrite=False)  # Warmup.
+
+    start_time = time.perf_counter()
+    for chromosome in chromosomes:
+        decoder.decode(chromosome, rewrite=False)
+    return (time.perf_counter() - start_time) / num_chromosomes
+
+###############################################################################
+
+def main() -> None:
+    args = docopt.docopt(__doc__)
+    instance_file = args["--instance_file"]
+    plots = [int(p) for p in args["--plots"].split(",")]
+    num_chromosomes = int(args["--num_chromosomes"])
+    rng = np.random.default_rng(int(args["--seed"]))
+
+    print("Plots | Nodes | ms/decode | us/plot")
+    times = []
+    for num_plots in plots:
+        instance = CrpInstance(instance_file, numero_lotes=num_plots)
+        elapsed = time_decodes(instance, num_chromosomes, rng)
+        times.append(elapsed)
+        print(f"{num_plots} | {instance.num_nodes} | {elapsed * 1e3:.2f} | "
+              f"{elapsed / num_plots * 1e6:.1f}")
+
+    if len(plots) > 1:
+        slope = np.polyfit(np.log(plots), np.log(times), 1)[0]
+        print(f"\nlog-log slope: {slope:.2f}")
+
+###############################################################################
+
+if __name__ == "__main__":
+    main()
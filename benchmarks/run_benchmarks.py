@@ -0,0 +1,344 @@
+"""
+Usage:
+  run_benchmarks.py [-c <config_file>] [-o <output_file>] \
+[-b <baseline_file>] [--tolerance <ratio>] [--repeats <n>] [--seeds <n>] \
+[--max_time <t>] [--micro_only | --macro_only]
+
+  run_benchmarks.py (-h | --help)
+
+Benchmark suite for the decoder and for the whole optimization.
+
+Micro benchmarks time ``CrpDecoder.decode``, ``decode_batch``,
+``build_terrain``, ``decode_swaps``, ``viabilidade`` and ``calcula_custo``
+on fixed sets of random chromosomes. Macro benchmarks measure the time to
+target (cost 0) of the BRKGA on ``dados-ipo`` and on synthetic instances
+with more crops, over a few seeds. Runs that miss the target count as the maximum time.
+
+The results are written as JSON. If a baseline file (a previous output) is
+given, each benchmark is compared against it, and the script exits with
+status 1 if any of them got slower by more than the tolerance. Benchmarks
+missing from the baseline are listed as having no baseline; re-record it
+after adding benchmarks. Baselines are only meaningful on the machine where
+they were recorded.
+
+Options:
+  -c --config_file <arg>    BRKGA-MP-IPR parameters for the macro benchmarks
+                            [default: config.conf].
+
+  -o --output_file <arg>    JSON file with the results
+                            [default: benchmarks/results.json].
+
+  -b --baseline_file <arg>  JSON file with the results to compare against.
+
+  --tolerance <arg>         Slowdown ratio accepted before a benchmark is
+                            reported as a regression [default: 0.10].
+
+  --repeats <arg>           Repetitions of each micro benchmark. The best
+                            one is kept [default: 5].
+
+  --seeds <arg>             Seeds of each macro benchmark [default: 3].
+
+  --max_time <arg>          Maximum time in seconds of each macro run
+                            [default: 30].
+
+  --micro_only              Run only the micro benchmarks.
+
+  --macro_only              Run only the macro benchmarks.
+
+  -h --help                 Produce help message.
+"""
+
+from datetime import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import docopt
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+from brkga_mp_ipr.types_io import load_configuration
+
+from crp_instance import CrpInstance
+from crp_decoder import CrpDecoder
+from crp_workspace import CrpWorkspace
+import gettimes
+
+###############################################################################
+# Instances
+###############################################################################
+
+INSTANCE_FILE = os.path.join(ROOT, "dados-ipo")
+
+# Synthetic instances: (name, number of regular crops, number of plots).
+SYNTHETIC = [
+    ("synthetic-48", 48, 2),
+    ("synthetic-96", 96, 2),
+]
+
+def make_synthetic_instance(directory: str, name: str, num_regular: int,
+                            rng: np.random.Generator) -> str:
+    """
+    Writes a random instance with the same layout as ``dados-ipo`` and
+    returns its file name, without the extension. The regular crops get
+    random families and periods drawn from ``dados-ipo``; the green manure
+    crops keep the periods of ``dados-ipo`` and form their own family.
+    """
+    data = np.loadtxt(INSTANCE_FILE + ".csv", delimiter=",", skiprows=1,
+                      dtype=int)
+    regular = data[:24]
+    green = data[24:]
+    num_families = int(regular[:, 1].max())
+
+    lines = ["cultura,família,periodo"]
+    for c in range(num_regular):
+        family = int(rng.integers(1, num_families + 1))
+        period = int(rng.choice(regular[:, 2]))
+        lines.append(f"{c + 1},{family},{period}")
+    for c, period in enumerate(green[:, 2], start=num_regular):
+        lines.append(f"{c + 1},{num_families + 1},{period}")
+
+    filename = os.path.join(directory, name)
+    with open(filename + ".csv", "w", encoding="utf-8") as hd:
+        hd.write("\n".join(lines) + "\n")
+    return filename
+
+###############################################################################
+# Micro benchmarks
+###############################################################################
+
+def best_time(function, repeats: int) -> float:
+    """
+    Returns the best wall time, in seconds, of ``repeats`` calls.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start_time)
+    return best
+
+def micro_benchmarks(instance: CrpInstance, label: str, repeats: int,
+                     num_chromosomes: int = 200) -> dict:
+    """
+    Times the decoder methods on a fixed set of random chromosomes. The
+    values are seconds per call.
+    """
+    rng = np.random.default_rng(2700001)
+    chromosomes = rng.random((num_chromosomes, instance.num_nodes))
+    decoder = CrpDecoder(instance)
+    ws = decoder.workspace()
+
+    # Feasibility queries over the terrains of the first chromosomes.
+    queries = [(int(rng.integers(instance.cultura_pousio)),
+                int(rng.integers(instance.numero_lotes)),
+                int(rng.integers(instance.duracao_plantio)))
+               for _ in range(1000)]
+    terrains = [decoder.build_terrain(chromosome, CrpWorkspace(instance))
+                for chromosome in chromosomes[:10]]
+
+    # Neighbors: random swaps of two positions of the crop order, decoded
+    # incrementally from the trail of the chromosome.
+    trails = [decoder.relink_base(*decoder.decodifica_ordem(chromosome))
+              for chromosome in chromosomes[:10]]
+    swaps = [[tuple(int(p) for p in rng.choice(instance.vetor_culturas_tam,
+                                                2, replace=False))]
+             for _ in range(20)]
+
+    def decode():
+        for chromosome in chromosomes:
+            decoder.decode(chromosome, rewrite=False)
+
+    def decode_batch():
+        decoder.decode_batch(chromosomes)
+
+    def build_terrain():
+        for chromosome in chromosomes:
+            decoder.build_terrain(chromosome, ws)
+
+    def viabilidade():
+        for terrain in terrains:
+            for cultura, lote, tempo in queries:
+                decoder.viabilidade(terrain, cultura, lote, tempo)
+
+    def decode_swaps():
+        for trail in trails:
+            for swap in swaps:
+                decoder.decode_swaps(trail, swap)
+
+    def calcula_custo():
+        for _ in range(num_chromosomes):
+            decoder.calcula_custo(ws)
+
+    decode()  # Warmup.
+    results = {
+        "decode": best_time(decode, repeats) / num_chromosomes,
+        "decode_batch": best_time(decode_batch, repeats) / num_chromosomes,
+        "build_terrain": best_time(build_terrain, repeats) / num_chromosomes,
+        "calcula_custo": best_time(calcula_custo, repeats) / num_chromosomes,
+        "decode_swaps": (best_time(decode_swaps, repeats)
+                         / (len(trails) * len(swaps))),
+        "viabilidade": (best_time(viabilidade, repeats)
+                        / (len(terrains) * len(queries))),
+    }
+
+    return {f"micro/{label}/{name}": value for name, value in results.items()}
+
+###############################################################################
+# Macro benchmarks
+###############################################################################
+
+def time_to_target(instance: CrpInstance, configuration_file: str,
+                   num_seeds: int, max_time: float) -> dict:
+    """
+    Runs the BRKGA until cost 0 for each seed, as ``gettimes.py`` does, and
+    returns the mean time to target and the number of runs that reached it.
+    """
+    brkga_params, control_params = load_configuration(configuration_file)
+    brkga_params.population_size = min(brkga_params.population_size,
+                                       10 * instance.num_nodes)
+    gettimes.init_runner(instance, {
+        "brkga_params": brkga_params,
+        "stop_rule": gettimes.StopRule.TARGET,
+        "stop_argument": 0.0,
+        "maximum_time": max_time,
+        "num_workers": 1,
+        "cache_size": 0,
+        "perform_evolution": True,
+        "pr_interval": 0,
+        "ls_interval": 0,
+        "ls_size": 1,
+        "exchange_interval": control_params.exchange_interval,
+        "num_exchange": control_params.num_exchange_indivuduals,
+        "prune": False,
+        "trace": False,
+    })
+
+    times = []
+    for seed in range(num_seeds):
+        record = gettimes.run_seed(seed)
+        ttt = record["time_to_target"]
+        times.append(max_time if ttt is None else ttt)
+
+    return {
+        "time_to_target": float(np.mean(times)),
+        "reached": sum(t < max_time for t in times),
+    }
+
+def macro_benchmarks(configuration_file: str, num_seeds: int,
+                     max_time: float) -> tuple:
+    """
+    Returns the time-to-target results and the number of successful runs of
+    each macro benchmark.
+    """
+    results = {}
+    reached = {}
+    rng = np.random.default_rng(0)
+
+    cases = [("dados-ipo-4", INSTANCE_FILE, 24, 4)]
+    with tempfile.TemporaryDirectory() as directory:
+        for name, num_regular, num_plots in SYNTHETIC:
+            filename = make_synthetic_instance(directory, name, num_regular,
+                                               rng)
+            cases.append((name, filename, num_regular, num_plots))
+
+        for name, filename, num_regular, num_plots in cases:
+            instance = CrpInstance(filename, numero_lotes=num_plots,
+                                   num_culturas_normais=num_regular)
+            result = time_to_target(instance, configuration_file, num_seeds,
+                                    max_time)
+            key = f"macro/{name}/time_to_target"
+            results[key] = result["time_to_target"]
+            reached[key] = result["reached"]
+            print(f"{key}: {results[key]:.3f} s "
+                  f"({reached[key]}/{num_seeds} reached)", flush=True)
+
+    return results, reached
+
+###############################################################################
+# Comparison
+###############################################################################
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Prints the ratio of each result to the baseline and returns the names
+    of the benchmarks that got slower than the tolerance allows. Benchmarks
+    missing from the baseline are printed as "no baseline" rows, so a
+    baseline that was not re-recorded after adding a benchmark shows up.
+    """
+    regressions = []
+    print("\nBenchmark | Baseline | Current | Ratio")
+    for name, value in results.items():
+        if name not in baseline:
+            print(f"{name} | no baseline | {value:.3e} | -")
+            continue
+        ratio = value / baseline[name] if baseline[name] > 0 else 1.0
+        flag = ""
+        if ratio > 1.0 + tolerance:
+            regressions.append(name)
+            flag = "  <- regression"
+        print(f"{name} | {baseline[name]:.3e} | {value:.3e} | "
+              f"{ratio:.2f}{flag}")
+    return regressions
+
+###############################################################################
+
+def main() -> None:
+    args = docopt.docopt(__doc__)
+    configuration_file = args["--config_file"]
+    output_file = args["--output_file"]
+    tolerance = float(args["--tolerance"])
+    repeats = int(args["--repeats"])
+    num_seeds = int(args["--seeds"])
+    max_time = float(args["--max_time"])
+
+    results = {}
+    reached = {}
+
+    if not args["--macro_only"]:
+        for label, num_plots in (("dados-ipo-1", 1), ("dados-ipo-10", 10)):
+            instance = CrpInstance(INSTANCE_FILE, numero_lotes=num_plots)
+            micro = micro_benchmarks(instance, label, repeats)
+            for name, value in micro.items():
+                print(f"{name}: {value * 1e6:.2f} us", flush=True)
+            results.update(micro)
+
+    if not args["--micro_only"]:
+        macro, reached = macro_benchmarks(configuration_file, num_seeds,
+                                          max_time)
+        results.update(macro)
+
+    report = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "seeds": num_seeds,
+        "max_time": max_time,
+        "reached": reached,
+        "results": results,
+    }
+    with open(output_file, "w", encoding="utf-8") as hd:
+        json.dump(report, hd, indent=2)
+        hd.write("\n")
+    print(f"\nResults saved to {output_file}")
+
+    if args["--baseline_file"]:
+        with open(args["--baseline_file"], "r", encoding="utf-8") as hd:
+            baseline = json.load(hd)["results"]
+        regressions = compare(results, baseline, tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above "
+                  f"{tolerance:.0%}.")
+            sys.exit(1)
+        print("\nNo regressions.")
+
+###############################################################################
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Usage:
+  convert_instance.py -i <instance_file> [-o <output_file>] [-l <plots>] \
+[--horizon <slots>] [--num_regular <n>] [--num_green <n>] [--fallow <slots>]
+
+  convert_instance.py (-h | --help)
+
+Converts a CSV instance to the binary format read by CrpInstance: a single
+.npy file with the crop table and the fields derived from it, which loads
+without pandas and can be memory-mapped. The plot count and the other
+parameters are saved with it, and are the defaults when the binary instance
+is loaded.
+
+Options:
+  -i --instance_file <arg>  CSV instance file, without the .csv extension.
+
+  -o --output_file <arg>    Binary instance file. Defaults to the instance
+                            file with the .npy extension.
+
+  -l --num_plots <arg>      Number of plots to be filled [default: 1].
+
+  --horizon <arg>           Length of the planting cycle, in time slots
+                            [default: 72].
+
+  --num_regular <arg>       Number of regular crops, which are the first rows
+                            of the instance file [default: 24].
+
+  --num_green <arg>         Number of green manure crops, which are the last
+                            rows of the instance file [default: 4].
+
+  --fallow <arg>            Length of the fallow period, in time slots
+                            [default: 3].
+
+  -h --help                 Produce help message.
+"""
+
+import docopt
+
+from crp_instance import CrpInstance
+
+###############################################################################
+
+def main() -> None:
+    args = docopt.docopt(__doc__)
+    instance_file = args["--instance_file"]
+    output_file = args["--output_file"] or instance_file + ".npy"
+
+    instance = CrpInstance(instance_file,
+                           numero_lotes=int(args["--num_plots"]),
+                           duracao_plantio=int(args["--horizon"]),
+                           num_culturas_verdes=int(args["--num_green"]),
+                           num_culturas_normais=int(args["--num_regular"]),
+                           duracao_pousio=int(args["--fallow"]))
+    instance.salva_binario(output_file)
+
+    print(f"{instance_file}.csv -> {output_file}: "
+          f"{instance.cultura_pousio} crops, {instance.numero_lotes} plots, "
+          f"{instance.num_nodes} nodes")
+
+###############################################################################
+
+if __name__ == "__main__":
+    main()
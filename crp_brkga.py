@@ -0,0 +1,761 @@
+import copy
+import math
+import time
+
+import numpy as np
+
+from brkga_mp_ipr.algorithm import BrkgaMpIpr
+from brkga_mp_ipr.enums import PathRelinkingResult, PathRelinkingSelection, \
+    PathRelinkingType, Sense
+from brkga_mp_ipr.types import BaseChromosome, Population
+
+class CrpBrkgaMpIpr(BrkgaMpIpr):
+    """
+    BRKGA-MP-IPR that decodes whole populations at once.
+
+    The original implementation calls ``decoder.decode()`` once per
+    chromosome. If the decoder offers ``decode_batch()``, this class hands it
+    all chromosomes that need decoding in a generation in a single call.
+    Otherwise, it falls back to ``decode()``. The mating procedure and the
+    random number stream are the same as the base class, except that the
+    elite chromosomes are copied to the next generation together with their
+    own fitness values (the base class mixes them up).
+
+    It also implements ``path_relink()``, which the base class leaves
+    unimplemented, for the CRP decoders: the moves are evaluated with
+    ``decoder.decode_swaps()`` and ``decoder.decode_relink()``, which only
+    redo the part of the terrain that a move may change. ``local_search()``
+    uses them as well, to improve the best chromosomes in place.
+    ``exchange_elite()``, also left unimplemented, copies the best
+    chromosomes of each population over the worst ones of the others.
+
+    If ``prune`` is True and the decoder has a ``bound`` attribute, the
+    offspring and mutants of each generation are decoded with the fitness
+    of the worst elite chromosome as the bound (when minimizing). Those that
+    cannot beat it may get a partial cost instead of the real one. The elite
+    sets are the same as without pruning, but the ranking of the other
+    chromosomes, and so the mating, may differ.
+    """
+
+    def __init__(self, *args, prune: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prune = prune
+
+    ###########################################################################
+
+    def decode_chromosomes(self, chromosomes: list) -> list:
+        """
+        Decodes the given chromosomes and returns their fitness values.
+        """
+        if not chromosomes:
+            return []
+        if hasattr(self._decoder, "decode_batch"):
+            return self._decoder.decode_batch(chromosomes).tolist()
+        return [self._decoder.decode(chromosome=chromosome, rewrite=True)
+                for chromosome in chromosomes]
+
+    ###########################################################################
+
+    def initialize(self) -> None:
+        """
+        Initializes the populations and others data structures of the BRKGA.
+        See ``BrkgaMpIpr.initialize()``.
+        """
+
+        if self._initialized and not self._reset_phase:
+            raise RuntimeError("The algorithm is already initialized. "
+                               "Please call 'reset()' instead.")
+
+        if self._bias_function is None:
+            raise ValueError("The bias function is not defined. "
+                             "Call set_bias_custom_function() before call "
+                             "initialize().")
+
+        # If we have warmstaters, complete the population if necessary.
+        # Note that it is done only in the true initialization.
+        pop_start = 0
+        if self._current_populations and not self._reset_phase:
+            population = self._current_populations[0]
+            for _ in range(len(population.chromosomes),
+                               self.params.population_size):
+                new_chr = self.generate_chromosome(self.chromosome_size)
+                population.chromosomes.append(new_chr)
+
+            population.fitness = [
+                (0.0, 0) for _ in range(self.params.population_size)
+            ]
+            pop_start = 1
+
+        elif not self._current_populations:
+            self._current_populations = [
+                Population()
+                for _ in range(self.params.num_independent_populations)
+            ]
+            self._previous_populations = [
+                Population()
+                for _ in range(self.params.num_independent_populations)
+            ]
+        # end if
+
+        # Build the remaining populations and associated data structures.
+        for i in range(pop_start, self.params.num_independent_populations):
+            # If no reset, allocate memory.
+            if not self._reset_phase:
+                population = self._current_populations[i]
+                for _ in range(self.params.population_size):
+                    population.chromosomes.append(
+                        self.generate_chromosome(self.chromosome_size)
+                    )
+                # end for
+                population.fitness = [
+                    (0.0, 0) for _ in range(self.params.population_size)
+                ]
+            else:
+                for chromosome in self._current_populations[i].chromosomes:
+                    self.fill_chromosome(chromosome)
+            # end if
+        # end for
+
+        # Perform initial decoding, one population per call.
+        for population in self._current_populations:
+            values = self.decode_chromosomes(population.chromosomes)
+            population.fitness = [(value, i) for i, value in enumerate(values)]
+            population.fitness.sort(reverse=(self.opt_sense == Sense.MAXIMIZE))
+        # end for
+
+        # Copy the data to previous populations.
+        self._previous_populations = copy.deepcopy(self._current_populations)
+        self._initialized = True
+        self._reset_phase = False
+
+    ###########################################################################
+
+    def get_fitness_values(self) -> list:
+        """
+        Returns the fitness values of all chromosomes of the current
+        populations.
+        """
+        return [value for population in self._current_populations
+                for value, _ in population.fitness]
+
+    ###########################################################################
+
+    def get_state(self) -> dict:
+        """
+        Returns a copy of the state of the evolution as NumPy arrays: the
+        chromosomes and fitness of the current populations, and the state of
+        the random number generator. With ``set_state()``, an algorithm built
+        with the same parameters continues exactly from this point.
+        """
+
+        if not self._initialized:
+            raise RuntimeError("The algorithm hasn't been initialized. "
+                               "Call 'initialize()' before 'get_state()'")
+
+        populations = self._current_populations
+        version, internal_state, gauss_next = self._rng.getstate()
+        return {
+            "chromosomes": np.array([population.chromosomes
+                                     for population in populations],
+                                    dtype=float),
+            "fitness_values": np.array([[value for value, _ in
+                                         population.fitness]
+                                        for population in populations]),
+            "fitness_indices": np.array([[idx for _, idx in
+                                          population.fitness]
+                                         for population in populations],
+                                        dtype=np.int64),
+            "rng_state": np.array(internal_state, dtype=np.uint64),
+            "rng_version": np.array(version),
+            "rng_gauss_next": np.array(np.nan if gauss_next is None
+                                       else gauss_next),
+        }
+
+    def set_state(self, state: dict) -> None:
+        """
+        Restores a state returned by ``get_state()``. The algorithm must be
+        initialized, with the same population sizes and chromosome size.
+        """
+
+        if not self._initialized:
+            raise RuntimeError("The algorithm hasn't been initialized. "
+                               "Call 'initialize()' before 'set_state()'")
+
+        shape = (self.params.num_independent_populations,
+                 self.params.population_size, self.chromosome_size)
+        if state["chromosomes"].shape != shape:
+            raise ValueError(f"Expected populations of shape {shape}. "
+                             f"Given {state['chromosomes'].shape}.")
+
+        for population, chromosomes, values, indices in zip(
+                self._current_populations, state["chromosomes"],
+                state["fitness_values"].tolist(),
+                state["fitness_indices"].tolist()):
+            for chromosome, keys in zip(population.chromosomes, chromosomes):
+                chromosome[:] = keys.tolist()
+            population.fitness = list(zip(values, indices))
+
+        gauss_next = float(state["rng_gauss_next"])
+        self._rng.setstate((int(state["rng_version"]),
+                            tuple(state["rng_state"].tolist()),
+                            None if np.isnan(gauss_next) else gauss_next))
+
+    ###########################################################################
+
+    def evolve_population(self, population_index: int) -> None:
+        """
+        Evolves the population ``population_index`` to the next generation.
+        See ``BrkgaMpIpr.evolve_population()``.
+        """
+
+        if not self._initialized:
+            raise RuntimeError("The algorithm hasn't been initialized. "
+                                "Call 'initialize()' before "
+                                "'evolve_population()'")
+
+        if population_index < 0 or \
+           population_index >= self.params.num_independent_populations:
+            raise ValueError(
+                f"Population must be in "
+                f"[0, {self.params.num_independent_populations - 1}]: "
+                f"{population_index}")
+
+        # Make names shorter.
+        curr_pop = self._current_populations[population_index]
+        next_pop = self._previous_populations[population_index]
+
+        # Which index we start to replace individuals.
+        replace_idx = self.params.population_size - self.num_mutants
+
+        # First, we copy the elite chromosomes to the next generation. The
+        # base class copies chromosome i instead of the i-th best one, which
+        # leaves the elite fitness values pointing to other chromosomes.
+        for i in range(self.elite_size):
+            value, idx = curr_pop.fitness[i]
+            next_pop.chromosomes[i][:] = curr_pop.chromosomes[idx][:]
+            next_pop.fitness[i] = (value, i)
+
+        # Then, we mate/crossover 'pop_size - elite_size - num_mutants' pairs.
+        for chr_idx in range(self.elite_size, replace_idx):
+            # First, we shuffled the elite set and non-elite set indices,
+            # then we take the elite and non-elite parents. Note that we cannot
+            # shuffled both sets together, otherwise we would mix elite
+            # and non-elite individuals.
+            elite_indices = list(range(self.elite_size))
+            self._rng.shuffle(elite_indices)
+            non_elite_indices = list(range(self.elite_size, replace_idx))
+            self._rng.shuffle(non_elite_indices)
+            shuffled_individuals = elite_indices + non_elite_indices
+
+            # Take the elite parents.
+            for i in range(self.params.num_elite_parents):
+                self._parents_ordered[i] = \
+                    curr_pop.fitness[shuffled_individuals[i]]
+
+            # Take the non-elite parents.
+            for i in range(self.params.total_parents -
+                           self.params.num_elite_parents):
+                self._parents_ordered[i + self.params.num_elite_parents] = \
+                    curr_pop.fitness[shuffled_individuals[i + self.elite_size]]
+
+            self._parents_ordered.sort(reverse=(self.opt_sense ==
+                                                Sense.MAXIMIZE))
+
+            # Performs the mate.
+            for allele in range(self.chromosome_size):
+                # Roullete method.
+                parent = 0
+                cumulative_probability = 0.0
+                toss = self._rng.random()
+                while cumulative_probability < toss:
+                    # Start parent from 1 because the bias function.
+                    parent += 1
+                    cumulative_probability += \
+                        self._bias_function(parent) / self._total_bias_weight
+
+                # Decrement parent to the right index.
+                parent -= 1
+                next_pop.chromosomes[chr_idx][allele] = curr_pop\
+                    .chromosomes[self._parents_ordered[parent][1]][allele]
+            # end for mate.
+        # end for crossover.
+
+        # To finish, we fill up the remaining spots with mutants.
+        for chr_idx in range(self.params.population_size - self.num_mutants,
+                             self.params.population_size):
+            self.fill_chromosome(next_pop.chromosomes[chr_idx])
+
+        # Perform the decoding on the offpring and mutants, all at once.
+        # Only the ones better than the worst elite one need exact values.
+        prune = self.prune and self.opt_sense == Sense.MINIMIZE and \
+            hasattr(self._decoder, "bound")
+        if prune:
+            self._decoder.bound = curr_pop.fitness[self.elite_size - 1][0]
+        try:
+            values = self.decode_chromosomes(
+                next_pop.chromosomes[self.elite_size:
+                                     self.params.population_size])
+        finally:
+            if prune:
+                self._decoder.bound = None
+        for i, value in enumerate(values, start=self.elite_size):
+            next_pop.fitness[i] = (value, i)
+
+        next_pop.fitness.sort(reverse=(self.opt_sense == Sense.MAXIMIZE))
+
+        # Swap populations.
+        self._previous_populations[population_index], \
+        self._current_populations[population_index] = \
+            self._current_populations[population_index], \
+            self._previous_populations[population_index]
+
+    ###########################################################################
+
+    def exchange_elite(self, num_immigrants: int) -> None:
+        """
+        Exchanges elite chromosomes between the populations: the
+        ``num_immigrants`` best chromosomes of each population are copied
+        over the worst chromosomes of each other population, together with
+        their fitness values, so nothing is decoded. The immigrants are
+        taken before any population receives them.
+        """
+
+        if not self._initialized:
+            raise RuntimeError("The algorithm hasn't been initialized. "
+                               "Call 'initialize()' before 'exchange_elite()'")
+
+        num_populations = self.params.num_independent_populations
+        max_immigrants = (self.params.population_size - self.elite_size) // \
+            max(num_populations - 1, 1)
+        if not 0 < num_immigrants <= max_immigrants:
+            raise ValueError(f"Number of immigrants must be in "
+                             f"[1, {max_immigrants}]. "
+                             f"Given {num_immigrants}.")
+
+        emigrants = [self.get_elite(num_immigrants, i)
+                     for i in range(num_populations)]
+        for i in range(num_populations):
+            self.add_immigrants([immigrant
+                                 for j, elite in enumerate(emigrants)
+                                 if j != i for immigrant in elite], i)
+
+    def get_elite(self, num_chromosomes: int,
+                  population_index: int = 0) -> list:
+        """
+        Returns copies of the ``num_chromosomes`` best chromosomes of the
+        population, best first, as (fitness, keys) pairs.
+        """
+        population = self._current_populations[population_index]
+        return [(value, list(population.chromosomes[idx]))
+                for value, idx in population.fitness[:num_chromosomes]]
+
+    def add_immigrants(self, immigrants: list,
+                       population_index: int = 0) -> None:
+        """
+        Copies the (fitness, keys) pairs over the worst chromosomes of the
+        population, which must not reach the elite set.
+        """
+        population = self._current_populations[population_index]
+        if len(immigrants) > self.params.population_size - self.elite_size:
+            raise ValueError(f"Too many immigrants for a population of "
+                             f"{self.params.population_size} with "
+                             f"{self.elite_size} elite chromosomes. "
+                             f"Given {len(immigrants)}.")
+
+        for k, (value, keys) in enumerate(immigrants, start=1):
+            _, idx = population.fitness[-k]
+            population.chromosomes[idx][:] = keys
+            population.fitness[-k] = (value, idx)
+        population.fitness.sort(reverse=(self.opt_sense == Sense.MAXIMIZE))
+
+    ###########################################################################
+
+    def path_relink(self, pr_type: PathRelinkingType,
+                    pr_selection: PathRelinkingSelection, dist: callable,
+                    number_pairs: int, minimum_distance: float,
+                    block_size: int = 1, max_time: int = 0,
+                    percentage: float = 1.0) -> PathRelinkingResult:
+        """
+        Performs path relinking between elite chromosomes of each population.
+
+        For each population, a pair of elite chromosomes at least
+        ``minimum_distance`` apart (according to ``dist``) is selected: the
+        best chromosome and a random elite one (``BESTSOLUTION``), or two
+        random elite ones (``RANDOMELITE``). Up to ``number_pairs`` pairs are
+        tried (0 means all elite chromosomes, for ``BESTSOLUTION``). Then, the
+        path from the first to the second is walked greedily, always taking
+        the best move, until ``percentage`` of the moves is done or
+        ``max_time`` seconds (0 means no limit) have passed. The best
+        chromosome found in the path replaces the worst chromosome of the
+        population, if it is better than the worst elite one.
+
+        ``PERMUTATION`` moves put a block of ``block_size`` ranks of the crop
+        order in the order of the guide, by swapping keys; ``DIRECT`` moves
+        copy a block of ``block_size`` keys from the guide. In both cases,
+        each plot starting key is also a move by itself.
+
+        Returns the combination of the results of all populations.
+        """
+
+        if not self._initialized:
+            raise RuntimeError("The algorithm hasn't been initialized. "
+                               "Call 'initialize()' before 'path_relink()'")
+
+        if block_size < 1:
+            raise ValueError(f"Block size must be larger than zero. "
+                             f"Given {block_size}.")
+
+        if not 0.0 < percentage <= 1.0:
+            raise ValueError(f"Percentage must be in (0, 1]. "
+                             f"Given {percentage}.")
+
+        start_time = time.time()
+        final_status = PathRelinkingResult.TOO_HOMOGENEOUS
+
+        for population in self._current_populations:
+            if max_time > 0 and time.time() - start_time > max_time:
+                break
+
+            pair = self._select_relink_pair(population, pr_selection, dist,
+                                            number_pairs, minimum_distance)
+            if pair is None:
+                continue
+
+            final_status |= PathRelinkingResult.NO_IMPROVEMENT
+            best_found = self._relink_pair(pair[0], pair[1], pr_type,
+                                           block_size, start_time, max_time,
+                                           percentage)
+            if best_found is None:
+                continue
+
+            # Re-decode to get the exact fitness (the moves assume that no
+            # two keys are equal).
+            best_chromosome = self._ChromosomeType(best_found)
+            best_value = self._decoder.decode(chromosome=best_chromosome,
+                                              rewrite=True)
+            best_overall = self.get_best_fitness()
+
+            if not self._is_better(best_value,
+                                   population.fitness[self.elite_size - 1][0]):
+                continue
+
+            # Replace the worst individual.
+            _, worst_idx = population.fitness[-1]
+            population.chromosomes[worst_idx][:] = best_chromosome
+            population.fitness[-1] = (best_value, worst_idx)
+            population.fitness.sort(reverse=(self.opt_sense == Sense.MAXIMIZE))
+
+            final_status |= PathRelinkingResult.ELITE_IMPROVEMENT
+            if self._is_better(best_value, best_overall):
+                final_status |= PathRelinkingResult.BEST_IMPROVEMENT
+        # end for
+
+        return final_status
+
+    ###########################################################################
+
+    def _is_better(self, value1: float, value2: float) -> bool:
+        if self.opt_sense == Sense.MINIMIZE:
+            return value1 < value2
+        return value1 > value2
+
+    ###########################################################################
+
+    def _select_relink_pair(self, population: Population,
+                            pr_selection: PathRelinkingSelection,
+                            dist: callable, number_pairs: int,
+                            minimum_distance: float):
+        """
+        Returns a pair (initial, guide) of elite chromosomes far enough from
+        each other, or None if the elite set is too homogeneous.
+        """
+        def chromosome(position):
+            return population.chromosomes[population.fitness[position][1]]
+
+        if pr_selection == PathRelinkingSelection.BESTSOLUTION:
+            initial = chromosome(0)
+            candidates = list(range(1, self.elite_size))
+            self._rng.shuffle(candidates)
+            if number_pairs > 0:
+                candidates = candidates[:number_pairs]
+            for position in candidates:
+                if dist(initial, chromosome(position)) >= minimum_distance:
+                    return initial, chromosome(position)
+            return None
+
+        if self.elite_size < 2:
+            return None
+        for _ in range(number_pairs if number_pairs > 0 else self.elite_size):
+            position1, position2 = self._rng.sample(range(self.elite_size), 2)
+            if dist(chromosome(position1),
+                    chromosome(position2)) >= minimum_distance:
+                return chromosome(position1), chromosome(position2)
+        return None
+
+    ###########################################################################
+
+    def _relink_pair(self, initial: BaseChromosome, guide: BaseChromosome,
+                     pr_type: PathRelinkingType, block_size: int,
+                     start_time: float, max_time: float,
+                     percentage: float):
+        """
+        Walks the path from ``initial`` to ``guide`` and returns the keys of
+        the best chromosome strictly inside the path, or None if the path is
+        empty.
+        """
+        decoder = self._decoder
+        instance = decoder.instance
+        tam = instance.vetor_culturas_tam
+
+        keys = list(initial)
+        guide = list(guide)
+        guide_order = sorted(range(tam), key=guide.__getitem__)
+        _, guide_tempos = decoder.decodifica_ordem(guide)
+
+        # Moves: ("ordem", block) and ("tempo", plot).
+        if pr_type == PathRelinkingType.PERMUTATION:
+            genes = range(tam)
+        else:
+            genes = [g for g in range(tam) if keys[g] != guide[g]]
+        moves = [("ordem", tuple(genes[i:i + block_size]))
+                 for i in range(0, len(genes), block_size)]
+        moves += [("tempo", lote) for lote in range(instance.numero_lotes)
+                  if keys[tam + lote] != guide[tam + lote]]
+        path_size = max(1, math.ceil(percentage * len(moves)))
+
+        base = decoder.relink_base(*decoder.decodifica_ordem(keys))
+        best_found = None
+        best_value = None
+
+        for _ in range(path_size):
+            if len(moves) < 2:
+                break  # The last move leads to the guide itself.
+            if max_time > 0 and time.time() - start_time > max_time:
+                break
+
+            if pr_type == PathRelinkingType.PERMUTATION:
+                order = sorted(range(tam), key=keys.__getitem__)
+                rank = [0] * tam
+                for r, g in enumerate(order):
+                    rank[g] = r
+
+            best_move = None
+            for move in moves:
+                kind, argument = move
+                candidate = list(keys)
+                tempos = base.tempos_ini
+
+                if kind == "tempo":
+                    tempos = list(tempos)
+                    tempos[argument] = guide_tempos[argument]
+                    candidate[tam + argument] = guide[tam + argument]
+                    lista = base.lista_culturas
+                    value = decoder.decode_swaps(base, [], tempos)
+                elif pr_type == PathRelinkingType.PERMUTATION:
+                    # Swap keys so each rank of the block gets the guide's
+                    # gene. Swapping two keys swaps their ranks, and so the
+                    # crops at those positions of the order.
+                    cand_order = list(order)
+                    cand_rank = list(rank)
+                    swaps = []
+                    for r in argument:
+                        g1 = cand_order[r]
+                        g2 = guide_order[r]
+                        if g1 == g2:
+                            continue
+                        r2 = cand_rank[g2]
+                        candidate[g1], candidate[g2] = candidate[g2], candidate[g1]
+                        cand_order[r], cand_order[r2] = g2, g1
+                        cand_rank[g1], cand_rank[g2] = r2, r
+                        swaps.append((r, r2))
+                    lista = base.troca(swaps)
+                    value = decoder.decode_swaps(base, swaps)
+                else:
+                    for g in argument:
+                        candidate[g] = guide[g]
+                    lista, tempos = decoder.decodifica_ordem(candidate)
+                    posicao = next((r for r, (a, b) in
+                                    enumerate(zip(lista, base.lista_culturas))
+                                    if a != b), tam)
+                    if posicao == tam and tempos == base.tempos_ini:
+                        value = base.custo  # Same solution, other keys.
+                    else:
+                        value = decoder.decode_relink(base, lista, tempos,
+                                                      posicao)
+
+                if best_move is None or self._is_better(value, best_move[0]):
+                    best_move = (value, move, candidate, lista, tempos)
+            # end for
+
+            value, move, keys, lista, tempos = best_move
+            moves.remove(move)
+            base = decoder.relink_base(lista, tempos)
+
+            if best_value is None or self._is_better(value, best_value):
+                best_value = value
+                best_found = list(keys)
+        # end for
+
+        return best_found
+
+
+    ###########################################################################
+
+    def local_search(self, num_individuals: int = 1,
+                     max_time: float = 0) -> int:
+        """
+        Improves the ``num_individuals`` best chromosomes of each population
+        by local search, until ``max_time`` seconds (0 means no limit) have
+        passed. Each improved chromosome is written back in place, with its
+        new fitness, so the evolution keeps it.
+
+        The search works on the decoded solution: the crop order and the
+        plot start slots. The moves are:
+        - swap two adjacent crops of the order, among the positions
+          examined by the first pass of the decoder. Swaps of crops that
+          the decoder cannot tell apart (``decoder.equivalentes()``) are
+          skipped without decoding;
+        - shift the start slot of a plot, and so its fallow, by one slot;
+        - move the green manure crop of a plot: swap it with each crop
+          planted in the plot by the first pass, or bring the next green
+          manure crop of the order if the plot got none.
+        The first improving move is taken, and the search stops at a local
+        optimum. Moves are evaluated with ``decoder.decode_swaps()``. They
+        are written back by swapping the keys of the two positions, and by
+        setting the key of the start slot.
+
+        Returns the number of chromosomes improved.
+        """
+
+        if not self._initialized:
+            raise RuntimeError("The algorithm hasn't been initialized. "
+                               "Call 'initialize()' before 'local_search()'")
+
+        if not 0 < num_individuals <= self.params.population_size:
+            raise ValueError(f"Number of individuals must be in "
+                             f"[1, {self.params.population_size}]. "
+                             f"Given {num_individuals}.")
+
+        start_time = time.time()
+        num_improved = 0
+
+        for population in self._current_populations:
+            for position in range(num_individuals):
+                if max_time > 0 and time.time() - start_time > max_time:
+                    break
+
+                value, idx = population.fitness[position]
+                keys = self._local_search_chromosome(
+                    population.chromosomes[idx], start_time, max_time)
+                if keys is None:
+                    continue
+
+                # Re-decode to get the exact fitness, as path_relink() does.
+                chromosome = self._ChromosomeType(keys)
+                new_value = self._decoder.decode(chromosome=chromosome,
+                                                 rewrite=True)
+                if not self._is_better(new_value, value):
+                    continue
+
+                population.chromosomes[idx][:] = chromosome
+                population.fitness[position] = (new_value, idx)
+                num_improved += 1
+            # end for
+
+            population.fitness.sort(reverse=(self.opt_sense == Sense.MAXIMIZE))
+        # end for
+
+        return num_improved
+
+    ###########################################################################
+
+    def _local_search_chromosome(self, initial: BaseChromosome,
+                                 start_time: float, max_time: float):
+        """
+        Runs the local search from ``initial`` and returns the keys of the
+        local optimum, or None if no move improved it.
+        """
+        decoder = self._decoder
+        instance = decoder.instance
+        tam = instance.vetor_culturas_tam
+        duracao = instance.duracao_plantio
+
+        keys = list(initial)
+        order = sorted(range(tam), key=keys.__getitem__)
+        base = decoder.relink_base(*decoder.decodifica_ordem(keys))
+        improved = False
+
+        while True:
+            for kind, argument in self._local_search_moves(base):
+                if max_time > 0 and time.time() - start_time > max_time:
+                    return keys if improved else None
+
+                if kind == "tempo":
+                    lote, tempo = argument
+                    tempos = list(base.tempos_ini)
+                    tempos[lote] = tempo
+                    value = decoder.decode_swaps(base, [], tempos)
+                else:
+                    value = decoder.decode_swaps(base, [argument])
+
+                if not self._is_better(value, base.custo):
+                    continue
+
+                if kind == "tempo":
+                    keys[tam + lote] = (tempo + 0.5) / duracao
+                    lista = base.lista_culturas
+                else:
+                    r1, r2 = argument
+                    g1, g2 = order[r1], order[r2]
+                    keys[g1], keys[g2] = keys[g2], keys[g1]
+                    order[r1], order[r2] = g2, g1
+                    lista = base.troca([argument])
+                    tempos = base.tempos_ini
+                base = decoder.relink_base(lista, tempos)
+                improved = True
+                break
+            else:
+                break  # Local optimum.
+        # end while
+
+        return keys if improved else None
+
+    def _local_search_moves(self, base):
+        """
+        Generates the moves of the local search around the solution of the
+        trail ``base``: ("troca", (r1, r2)) swaps two positions of the crop
+        order, and ("tempo", (plot, slot)) sets the start slot of a plot.
+        """
+        decoder = self._decoder
+        instance = decoder.instance
+        lista = base.lista_culturas
+        verde = instance.cultura_verde
+
+        # Green manure crops.
+        for lote, plantadas in enumerate(base.plantadas):
+            verdes = [posicao for classe, posicao in plantadas
+                      if classe == verde]
+            if verdes:
+                posicao_verde = verdes[0]
+            else:
+                inicio = plantadas[-1][1] + 1 if plantadas else 0
+                posicao_verde = next(
+                    (posicao for posicao in range(inicio, len(lista))
+                     if instance.verdes[lista[posicao]]), None)
+                if posicao_verde is None:
+                    continue
+            for _, posicao in plantadas:
+                if posicao != posicao_verde:
+                    yield "troca", (min(posicao, posicao_verde),
+                                    max(posicao, posicao_verde))
+
+        # Plot start slots, and so fallows.
+        for lote, tempo in enumerate(base.tempos_ini):
+            for passo in (-1, 1):
+                yield "tempo", (lote, (tempo + passo) % instance.duracao_plantio)
+
+        # Adjacent crops.
+        limite = min(len(lista) - 1, max(base.fronteiras) + 1)
+        for posicao in range(limite):
+            if not decoder.equivalentes(lista[posicao], lista[posicao + 1]):
+                yield "troca", (posicao, posicao + 1)
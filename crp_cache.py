@@ -0,0 +1,62 @@
+from collections import OrderedDict
+import threading
+
+class FitnessCache():
+    """
+    Bounded LRU cache of fitness values.
+
+    The keys are the decoded crop order and the starting fallow slot of each
+    plot, which fully determine the terrain built by the decoder. Many
+    chromosomes share the same key, mainly after the population converges.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError(f"Cache capacity must be larger than zero. "
+                             f"Given {capacity}.")
+
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """
+        Returns the fitness stored for ``key``, or None if it is not cached.
+        """
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            if len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return (f"hits {self.hits} | misses {self.misses} | "
+                f"evictions {self.evictions} | hit rate {hit_rate:.2%}")
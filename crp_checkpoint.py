@@ -0,0 +1,79 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+class CrpCheckpoint():
+    """
+    Periodic checkpoints of a run, so it can be resumed after being stopped.
+
+    A checkpoint holds the arrays of the algorithm state (see
+    ``CrpBrkgaMpIpr.get_state()``) and a dict of counters of the main loop,
+    saved as JSON, in a single uncompressed ``.npz`` file. The caller only
+    takes the snapshot; the file is written by a background thread, into a
+    temporary file that then replaces ``filename``, so a run stopped in the
+    middle of a write keeps the previous checkpoint. If the previous write
+    is still running when a new checkpoint is due, the new one is skipped,
+    so the cost of checkpointing is at most one snapshot per ``interval``
+    seconds.
+    """
+
+    def __init__(self, filename: str, interval: float):
+        self.filename = filename
+        self.interval = interval
+        self.num_saved = 0
+        self.num_skipped = 0
+        self._last_time = time.time()
+        self._thread = None
+
+    def due(self) -> bool:
+        return time.time() - self._last_time >= self.interval
+
+    def save(self, state: dict, counters: dict) -> bool:
+        """
+        Starts writing a checkpoint with the given arrays and counters, and
+        returns True, or returns False if the previous checkpoint is still
+        being written.
+        """
+        self._last_time = time.time()
+        if self._thread is not None and self._thread.is_alive():
+            self.num_skipped += 1
+            return False
+
+        arrays = dict(state)
+        arrays["counters"] = np.array(json.dumps(counters))
+        self._thread = threading.Thread(target=self._write, args=(arrays,),
+                                        daemon=True)
+        self._thread.start()
+        return True
+
+    def close(self) -> None:
+        """
+        Waits for the checkpoint being written, if any.
+        """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _write(self, arrays: dict) -> None:
+        temporary = self.filename + ".tmp"
+        with open(temporary, "wb") as hd:
+            np.savez(hd, **arrays)
+            hd.flush()
+            os.fsync(hd.fileno())
+        os.replace(temporary, self.filename)
+        self.num_saved += 1
+
+###############################################################################
+
+def load_checkpoint(filename: str) -> tuple:
+    """
+    Returns the algorithm state and the counters saved by ``CrpCheckpoint``.
+    """
+    with np.load(filename) as data:
+        state = {name: data[name] for name in data.files
+                 if name != "counters"}
+        counters = json.loads(str(data["counters"]))
+    return state, counters
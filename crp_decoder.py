@@ -1,191 +1,511 @@
-import matplotlib.pyplot as plt
 import math
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from heapq import heapify, heappop, heappush
+import numpy as np
 from crp_instance import CrpInstance
+from crp_workspace import CrpTrilha, CrpWorkspace
+from crp_solution import CrpSolucao
+from crp_cache import FitnessCache
+from crp_stats import CrpStats
 from brkga_mp_ipr.types import BaseChromosome
 
 class CrpDecoder():
     """
     Simple Traveling Salesman Problem decoder. It creates a permutation of
     nodes induced by the chromosome and computes the cost of the tour.
+
+    The decoder never writes into the instance. Terrains are built into a
+    ``CrpWorkspace``, one per thread, so several threads can decode at the
+    same time against the same instance.
+
+    If ``cache_size`` is positive, the fitness of the last ``cache_size``
+    distinct crop orders is kept in a LRU cache (see ``FitnessCache``), and
+    chromosomes that decode to a cached order skip ``build_terrain``.
+
+    If ``stats`` is given, the decoder records its timings there (see
+    ``CrpStats``).
+
+    If ``bound`` is set, ``decode`` and ``decode_batch`` stop a terrain as
+    soon as its cost provably exceeds the bound: the plots are final after
+    their second pass, so the cost of the plots done so far is a lower
+    bound. Then they return that partial cost. Values up to the bound are
+    exact; values above it may be lower than the real cost, and are not
+    cached.
     """
 
-    def __init__(self, instance: CrpInstance):
+    def __init__(self, instance: CrpInstance, cache_size: int = 0,
+                 stats: CrpStats = None):
         self.instance = instance
+        self.cache = FitnessCache(cache_size) if cache_size > 0 else None
+        self.stats = stats
+        self.bound = None
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def workspace(self) -> CrpWorkspace:
+      "Retorna o espaço de trabalho da thread atual"
+      ws = getattr(self._local, "ws", None)
+      if ws is None:
+        ws = self._local.ws = CrpWorkspace(self.instance)
+      return ws
 
     ###########################################################################
     def decode(self, chromosome: BaseChromosome, rewrite: bool) -> float:
-        self.build_terrain(chromosome)
+        if self.stats is not None:
+            start_time = time.perf_counter()
 
-        return self.calcula_custo()
+        lista_culturas, tempos_ini = self.decodifica_ordem(chromosome)
+        custo = self.custo_ordem(lista_culturas, tempos_ini)
 
-    ###########################################################################
-    def build_terrain(self, chromosome):
-      self.instance.reset()
-      permutation = sorted((key, index) for index, key in enumerate(chromosome[:self.instance.vetor_culturas_tam]))
-      lista_culturas = list(self.get_cultura(value) for index, value in permutation)
+        if self.stats is not None:
+            self.stats.record_decode(time.perf_counter() - start_time)
+        return custo
 
-      for i in range(self.instance.numero_lotes):
-        tempo_ini = self.denormalize(chromosome[self.instance.vetor_culturas_tam + i],self.instance.duracao_plantio)
+    ###########################################################################
+    def decode_batch(self, chromosomes) -> np.ndarray:
+      """
+      Decodifica uma população inteira (matriz 2-D de chaves, um cromossomo
+      por linha) e retorna o vetor de custos. A ordenação das chaves, o
+      mapeamento para as culturas e o cálculo do custo são feitos com
+      operações vetoriais; apenas o preenchimento guloso dos lotes é feito
+      cromossomo a cromossomo.
+      """
+      if self.stats is not None:
+        start_time = time.perf_counter()
+
+      culturas, tempos_ini = self.prepara_batch(chromosomes)
+      if self.cache is not None:
+        custos = np.array([self.custo_ordem(lista_culturas, tempos)
+                           for lista_culturas, tempos in zip(culturas, tempos_ini)], dtype=int)
+      else:
+        ws = self.workspace()
+        vazios = np.empty((len(culturas), self.instance.numero_lotes), dtype=int)
+        verdes = np.empty((len(culturas), self.instance.numero_lotes), dtype=int)
+        podados = {}
+        for b, (lista_culturas, tempos) in enumerate(zip(culturas, tempos_ini)):
+          parcial = self.preenche_terreno(ws, lista_culturas, tempos, self.bound)
+          if parcial is not None:
+            podados[b] = parcial
+          vazios[b] = ws.num_vazios
+          verdes[b] = ws.num_verdes
+        custos = self.calcula_custo_batch(vazios, verdes)
+        for b, parcial in podados.items():
+          custos[b] = parcial
+
+      if self.stats is not None:
+        self.stats.record_decode(time.perf_counter() - start_time)
+      return custos
+
+    def prepara_batch(self, chromosomes):
+      "Retorna a ordem das culturas e os tempos iniciais de cada cromossomo da matriz"
+      chaves = np.asarray(chromosomes, dtype=float)
+      if chaves.ndim != 2 or chaves.shape[1] != self.instance.num_nodes:
+        raise ValueError(f"Esperada uma matriz com {self.instance.num_nodes} "
+                         f"colunas. Dado {chaves.shape}.")
+
+      tam = self.instance.vetor_culturas_tam
+      # argsort estável desempata pelo índice, como o sorted((chave, índice)).
+      ordem = np.argsort(chaves[:, :tam], axis=1, kind="stable")
+      culturas = self.get_culturas(ordem)
+      tempos_ini = np.ceil(chaves[:, tam:] * self.instance.duracao_plantio).astype(int) - 1
+      return culturas.tolist(), tempos_ini.tolist()
+
+    def custo_ordem(self, lista_culturas, tempos_ini):
+      "Retorna o custo da solução dada pela ordem das culturas e tempos iniciais, usando o cache se houver"
+      if self.cache is None:
+        ws = self.workspace()
+        parcial = self.preenche_terreno(ws, lista_culturas, tempos_ini, self.bound)
+        return self.calcula_custo(ws) if parcial is None else parcial
+
+      chave = (tuple(lista_culturas), tuple(tempos_ini))
+      custo = self.cache.get(chave)
+      if custo is None:
+        ws = self.workspace()
+        parcial = self.preenche_terreno(ws, lista_culturas, tempos_ini, self.bound)
+        if parcial is not None:
+          return parcial
+        custo = self.calcula_custo(ws)
+        self.cache.put(chave, custo)
+      return custo
 
-        next_position = self.planta(self.instance.cultura_pousio, i, tempo_ini)
+    ###########################################################################
+    def build_terrain(self, chromosome, ws=None):
+      "Constrói os lotes do cromossomo no espaço de trabalho dado (ou no da thread) e o retorna"
+      if ws is None:
+        ws = self.workspace()
+      lista_culturas, tempos_ini = self.decodifica_ordem(chromosome)
+      self.preenche_terreno(ws, lista_culturas, tempos_ini)
+      return ws
+
+    def decodifica_ordem(self, chromosome):
+      "Retorna a ordem das culturas e o tempo inicial de cada lote dados pelo cromossomo"
+      permutation = sorted((key, index) for index, key in enumerate(chromosome[:self.instance.vetor_culturas_tam]))
+      lista_culturas = self.get_culturas([value for index, value in permutation])
+      tempos_ini = [self.denormalize(chromosome[self.instance.vetor_culturas_tam + i], self.instance.duracao_plantio)
+                    for i in range(self.instance.numero_lotes)]
+      return lista_culturas, tempos_ini
+
+    def preenche_terreno(self, ws, lista_culturas, tempos_ini, limite=None):
+      """
+      Preenche os lotes de forma gulosa com as culturas na ordem dada.
+
+      As culturas que sobram de um lote passam para o próximo pela fila
+      ws.fila (ver ``CrpFila``). Cada passo acha a próxima cultura viável com
+      uma busca por classe de cultura, e não varrendo a fila, de modo que o
+      tempo de decodificação cresce linearmente com o número de lotes.
+
+      Se limite for dado e o custo passar dele, para no meio da segunda
+      passada e retorna o custo parcial (ver segunda_passada); senão retorna
+      None.
+      """
+      stats = self.stats
+      if stats is not None:
+        inicio_primeira = time.perf_counter()
+
+      ws.reset()
+      fila = ws.fila
+      fila.reset(lista_culturas)
+      self.primeira_passada(ws, fila, tempos_ini, 0)
+
+      if stats is not None:
+        inicio_segunda = time.perf_counter()
+
+      parcial = self.segunda_passada(ws, fila, tempos_ini, limite)
+
+      if stats is not None:
+        stats.record_terrain(inicio_segunda - inicio_primeira,
+                             time.perf_counter() - inicio_segunda,
+                             parcial is not None)
+      return parcial
+
+    def primeira_passada(self, ws, fila, tempos_ini, primeiro_lote, trilha=None):
+      "Planta o pousio e depois as culturas da fila em cada lote, a partir de primeiro_lote"
+      for i in range(primeiro_lote, self.instance.numero_lotes):
+        tempo_ini = tempos_ini[i]
+
+        next_position = self.planta(ws, self.instance.cultura_pousio, i, tempo_ini)
 
         # Tenta plantar as outras culturas na ordem
-        nova_lista_culturas = []
-        cultura_verde_plantada = False
-        for j in range(len(lista_culturas)):
-          cultura_atual = lista_culturas[j]
-          if cultura_atual >= self.instance.num_culturas_normais and cultura_atual != self.instance.cultura_pousio:
-            # Cultura verde
-            cultura_atual = self.instance.cultura_verde
-            if cultura_verde_plantada:
-              nova_lista_culturas.append(cultura_atual)
-              continue
-
-          if self.viabilidade(cultura_atual, i, next_position):
-            next_position = self.planta(cultura_atual, i, next_position)
-            if cultura_atual >= self.instance.num_culturas_normais and cultura_atual != self.instance.cultura_pousio:
-              # Cultura verde
-              cultura_verde_plantada = True
-
-            if self.instance.terrenos[i][self.wrap(next_position + self.instance.min_duracao)] != -1:
-              nova_lista_culturas.extend(lista_culturas[j+1:])
-              break # ja esta cheio
-          else:
-            nova_lista_culturas.append(cultura_atual)
-
-        lista_culturas = nova_lista_culturas
+        if trilha is None:
+          self.planta_lista(ws, i, fila, next_position)
+        else:
+          plantadas = []
+          trilha.fronteiras.append(self.planta_lista(ws, i, fila, next_position, plantadas))
+          trilha.plantadas.append(plantadas)
+          trilha.estados.append(ws.salva_lote(i))
+
+    def segunda_passada(self, ws, fila, tempos_ini, limite=None):
+      """
+      Replanta cada lote que ficou com custo, a partir do fim do pousio, e
+      mantém se melhorar.
+
+      Um lote não muda mais depois da sua segunda passada, então a soma dos
+      custos dos lotes já passados é um limite inferior do custo final. Se
+      limite for dado e essa soma passar dele, para e retorna a soma; senão
+      retorna None.
+      """
+      parcial = 0
       for i in range(self.instance.numero_lotes):
         # Segunda passada
-        custo1 = self.calcula_custo_lote(i)
+        custo1 = ws.custo_lote(i)
         if custo1 > 0:
-          lote_antigo = list(self.instance.terrenos[i])
-          lista_culturas_antiga = list(lista_culturas)
-          for j in range(self.instance.duracao_plantio):
-            if self.instance.terrenos[i][j] != -1 and self.instance.terrenos[i][j] != self.instance.cultura_pousio and self.instance.terrenos[i][j] != self.instance.terrenos[i][self.wrap(j-1)]:
-              lista_culturas.append(self.instance.terrenos[i][j])
-              self.desplanta(i, j)
-          tempo_ini = self.denormalize(chromosome[self.instance.vetor_culturas_tam + i],self.instance.duracao_plantio)
-
-          next_position = self.wrap(tempo_ini + self.instance.duracao_pousio)
+          lote_antigo = ws.salva_lote(i)
+          # Arranca as culturas do lote, na ordem do tempo de início, e as põe
+          # no fim da fila
+          removidas = []
+          for inicio, cultura in lote_antigo[2]:
+            if cultura != self.instance.cultura_pousio:
+              fila.append(cultura)
+              removidas.append(cultura)
+              self.desplanta(ws, i, inicio)
+          next_position = self.wrap(tempos_ini[i] + self.instance.duracao_pousio)
 
           # Tenta plantar as outras culturas na ordem
-          nova_lista_culturas = []
-          cultura_verde_plantada = False
-          for j in range(len(lista_culturas)):
-            cultura_atual = lista_culturas[j]
-            if cultura_atual >= self.instance.num_culturas_normais and cultura_atual != self.instance.cultura_pousio:
-              # Cultura verde
-              cultura_atual = self.instance.cultura_verde
-              if cultura_verde_plantada:
-                nova_lista_culturas.append(cultura_atual)
-                continue
-
-            if self.viabilidade(cultura_atual, i, next_position):
-              next_position = self.planta(cultura_atual, i, next_position)
-              if cultura_atual >= self.instance.num_culturas_normais and cultura_atual != self.instance.cultura_pousio:
-                # Cultura verde
-                cultura_verde_plantada = True
-
-              if self.instance.terrenos[i][self.wrap(next_position + self.instance.min_duracao)] != -1:
-                nova_lista_culturas.extend(lista_culturas[j+1:])
-                break # ja esta cheio
-            else:
-              nova_lista_culturas.append(cultura_atual)
-          custo2 = self.calcula_custo_lote(i)
-          if custo2 < custo1:
-            lista_culturas = nova_lista_culturas
-          else:
-            lista_culturas = lista_culturas_antiga
-            self.instance.terrenos[i] = lote_antigo
+          plantadas = []
+          self.planta_lista(ws, i, fila, next_position, plantadas)
+          custo2 = ws.custo_lote(i)
+          if custo2 >= custo1:
+            # Desfaz a segunda passada do lote, devolvendo a fila ao que era
+            for classe, posicao in plantadas:
+              fila.insere(classe, posicao)
+            for cultura in reversed(removidas):
+              fila.pop(cultura)
+            ws.restaura_lote(i, lote_antigo)
+
+        if limite is not None:
+          parcial += ws.custo_lote(i)
+          if parcial > limite:
+            return parcial
+      return None
 
-    
-    def draw_chart(self, chromosome):
-      def get_bar_length(lote, tempo):
-        cultura = self.instance.terrenos[lote][tempo]
-        length = 0
-        i = tempo
-        while  i < self.instance.duracao_plantio and self.instance.terrenos[lote][i] == cultura:
-          length += 1
-          i += 1
-        return length
-
-      self.build_terrain(chromosome)
-      fig, ax = plt.subplots()
+    ###########################################################################
+    def relink_base(self, lista_culturas, tempos_ini) -> CrpTrilha:
+      """
+      Decodifica a ordem das culturas guardando a trilha da primeira passada,
+      e retorna a trilha, com o custo em trilha.custo. As soluções vizinhas
+      são então decodificadas por decode_relink.
+      """
+      ws = self.workspace()
+      ws.reset()
+      fila = ws.fila
+      fila.reset(lista_culturas)
+      trilha = CrpTrilha(lista_culturas, tempos_ini)
+      self.primeira_passada(ws, fila, tempos_ini, 0, trilha)
+      self.segunda_passada(ws, fila, tempos_ini)
+      trilha.custo = self.calcula_custo(ws)
+      return trilha
+
+    def decode_relink(self, trilha: CrpTrilha, lista_culturas, tempos_ini, posicao: int) -> int:
+      """
+      Retorna o custo de uma ordem de culturas que é igual à da trilha até
+      antes de posicao. Os lotes cuja primeira passada não chegou a examinar
+      posicao, e cujos tempos iniciais não mudaram, são restaurados da
+      trilha. No primeiro lote afetado, os plantios de posições anteriores a
+      posicao são repetidos sem busca, e a varredura da fila continua do
+      último deles; só o resto da primeira passada e a segunda passada são
+      refeitos. O resultado é igual ao de decodificar a ordem do zero.
+      """
+      instance = self.instance
+      numero_lotes = instance.numero_lotes
+      lote = 0
+      while lote < numero_lotes and trilha.fronteiras[lote] < posicao \
+            and tempos_ini[lote] == trilha.tempos_ini[lote]:
+        lote += 1
+
+      ws = self.workspace()
+      fila = ws.fila
+      fila.reset(lista_culturas)
+      for i in range(lote):
+        ws.copia_lote(i, trilha.estados[i])
+        for classe, posicao_plantada in trilha.plantadas[i]:
+          fila.retira(classe, posicao_plantada)
+      for i in range(lote, numero_lotes):
+        ws.limpa_lote(i)
+
+      if lote < numero_lotes:
+        # Plantios do lote que não dependem do que mudou
+        repetidos = []
+        if tempos_ini[lote] == trilha.tempos_ini[lote]:
+          repetidos = [plantada for plantada in trilha.plantadas[lote] if plantada[1] < posicao]
+
+        next_position = self.planta(ws, instance.cultura_pousio, lote, tempos_ini[lote])
+        inicio = 0
+        verde_plantada = False
+        for classe, posicao_plantada in repetidos:
+          fila.retira(classe, posicao_plantada)
+          next_position = self.planta(ws, classe, lote, next_position)
+          inicio = posicao_plantada + 1
+          verde_plantada = verde_plantada or classe == instance.cultura_verde
+        self.planta_lista(ws, lote, fila, next_position, None, inicio, verde_plantada)
+        self.primeira_passada(ws, fila, tempos_ini, lote + 1)
+
+      self.segunda_passada(ws, fila, tempos_ini)
+      return self.calcula_custo(ws)
+
+    def decode_swaps(self, trilha: CrpTrilha, trocas, tempos_ini=None) -> int:
+      """
+      Retorna o custo da ordem de culturas da trilha com as trocas dadas,
+      pares (i, j) de posições da ordem (ou seja, da permutação induzida
+      pelo cromossomo), aplicadas em sequência, e com os tempos iniciais
+      dados (por padrão, os da trilha). A decodificação é refeita a partir
+      do primeiro plantio afetado (ver decode_relink).
+      """
+      lista_culturas = trilha.troca(trocas)
+      if tempos_ini is None:
+        tempos_ini = trilha.tempos_ini
+      posicao = next((r for r, (a, b) in enumerate(zip(lista_culturas, trilha.lista_culturas))
+                      if a != b), len(lista_culturas))
+      if posicao == len(lista_culturas) and list(tempos_ini) == trilha.tempos_ini:
+        return trilha.custo
+      return self.decode_relink(trilha, lista_culturas, tempos_ini, posicao)
+
+    def warmup(self, num_chromosomes: int = 20, seed: int = 0) -> float:
+      """
+      Aquece o decodificador antes de uma execução cronometrada: decodifica
+      um pequeno lote de cromossomos aleatórios pelo caminho de
+      decode_batch, e uma vizinhança pelo de decode_swaps, sem passar pelo
+      cache. Retorna o tempo gasto, em segundos.
+      """
+      inicio = time.perf_counter()
+      chaves = np.random.default_rng(seed).random((num_chromosomes, self.instance.num_nodes))
+      culturas, tempos_ini = self.prepara_batch(chaves)
+      ws = self.workspace()
+      for lista_culturas, tempos in zip(culturas, tempos_ini):
+        self.preenche_terreno(ws, lista_culturas, tempos)
+        self.calcula_custo(ws)
+
+      trilha = self.relink_base(culturas[0], tempos_ini[0])
+      self.decode_swaps(trilha, [(0, 1)])
+      return time.perf_counter() - inicio
+
+    def distance(self, chromosome1, chromosome2) -> float:
+      """
+      Distância entre dois cromossomos no espaço das soluções: a fração das
+      posições da ordem das culturas, e dos tempos iniciais dos lotes, que
+      diferem. Cromossomos com chaves diferentes mas a mesma solução
+      decodificada ficam a distância 0.
+      """
+      culturas, tempos_ini = self.prepara_batch([chromosome1, chromosome2])
+      diferentes = sum(a != b for a, b in zip(culturas[0], culturas[1])) \
+          + sum(a != b for a, b in zip(tempos_ini[0], tempos_ini[1]))
+      return diferentes / (len(culturas[0]) + len(tempos_ini[0]))
+
+    def equivalentes(self, cultura1, cultura2):
+      """
+      Retorna se as culturas são indistinguíveis para o preenchimento dos
+      lotes, de modo que trocá-las de posição na ordem não muda o custo: as
+      culturas verdes são plantadas todas como cultura_verde, e as outras só
+      importam pela família e pela duração.
+      """
+      instance = self.instance
+      if instance.verdes[cultura1] or instance.verdes[cultura2]:
+        return instance.verdes[cultura1] and instance.verdes[cultura2]
+      return instance.familias[cultura1] == instance.familias[cultura2] \
+          and instance.duracoes[cultura1] == instance.duracoes[cultura2]
+
+    def planta_lista(self, ws, lote, fila, next_position, plantadas=None,
+                     inicio=0, verde_plantada=False):
+      """
+      Percorre a fila uma vez, em ordem, plantando no lote a partir de
+      next_position cada cultura viável, até o lote ficar cheio. As culturas
+      plantadas saem da fila; as outras ficam onde estão. Se plantadas for
+      dada, anota nela (classe, posição) de cada cultura retirada da fila.
+
+      Para continuar uma varredura interrompida, inicio é a primeira posição
+      da fila a examinar e verde_plantada diz se o lote já recebeu a sua
+      cultura verde.
+
+      Em vez de examinar cada cultura da fila, examina só a próxima
+      ocorrência de cada classe, em ordem de posição: as outras ocorrências
+      de uma classe inviável também seriam inviáveis. Cada classe está no
+      máximo uma vez no heap, codificada como posição * num_classes + classe,
+      e o índice da ocorrência na sua lista fica em indice[classe].
+
+      Retorna a maior posição da fila examinada, ou infinito se a fila foi
+      examinada até o fim.
+      """
+      instance = self.instance
+      verde = instance.cultura_verde
+      posicoes = fila.posicoes
+      nc = len(posicoes)
+      indice = fila.indice
+      heap = []
+      if inicio == 0:
+        for classe in fila.classes:
+          if posicoes[classe]:
+            indice[classe] = 0
+            heap.append(posicoes[classe][0] * nc + classe)
+      else:
+        for classe in fila.classes:
+          lista = posicoes[classe]
+          k = indice[classe] = bisect_left(lista, inicio)
+          if k < len(lista):
+            heap.append(lista[k] * nc + classe)
+      heapify(heap)
+      adiadas = []
+      cultura_verde_plantada = verde_plantada
+      while heap:
+        posicao, cultura_atual = divmod(heappop(heap), nc)
+        if cultura_atual == verde and cultura_verde_plantada:
+          continue
+        if not self.viabilidade(ws, cultura_atual, lote, next_position):
+          adiadas.append(cultura_atual)
+          continue
+
+        lista = posicoes[cultura_atual]
+        k = indice[cultura_atual]
+        del lista[k]
+        if plantadas is not None:
+          plantadas.append((cultura_atual, posicao))
+        next_position = self.planta(ws, cultura_atual, lote, next_position)
+        if cultura_atual == verde:
+          cultura_verde_plantada = True
+
+        if not ws.livre(lote, self.wrap(next_position + instance.min_duracao)):
+          return posicao # ja esta cheio
+
+        # A varredura continua depois da cultura plantada: cada classe volta
+        # para o heap com a sua próxima ocorrência depois dessa posição.
+        if k < len(lista):
+          heappush(heap, lista[k] * nc + cultura_atual)
+        for classe in adiadas:
+          lista = posicoes[classe]
+          k = indice[classe] = bisect_right(lista, posicao)
+          if k < len(lista):
+            heappush(heap, lista[k] * nc + classe)
+        adiadas.clear()
+      return math.inf
 
-      for i in range(self.instance.numero_lotes):
-        cultura_atual = None
-        for j in range(self.instance.duracao_plantio):
-          if self.instance.terrenos[i][j] != cultura_atual:
-            cultura_atual = self.instance.terrenos[i][j]
-            length = get_bar_length(i, j)
-            ax.broken_barh([(j, length)], (i+0.5, 1), facecolor='white', edgecolor='black')
-            ax.text(j + length/2, i+1, str(cultura_atual+1), va = 'center', ha = 'center', size = 'small')
-      ax.set_ylim(0.5, self.instance.numero_lotes + 0.5)
-      ax.set_xlim(0, self.instance.duracao_plantio)
-      ax.set_yticks([k for k in range(1, self.instance.numero_lotes+1)])
-      ax.set_xticks([k for k in range(0, self.instance.duracao_plantio, 10)])
-
-      plt.savefig("result.png")
-
-
-    def get_cultura(self, valor):
-      "Retorna o indice da cultura na matriz dado o valor do índice no cromossomo"
-      for i in range(len(self.instance.posicao_cultura)):
-        if valor<self.instance.posicao_cultura[i]:
-          return i
-
-    def planta(self, cultura,lote,tempo):
+    
+    def solucao(self, chromosome, ws=None) -> CrpSolucao:
+      "Retorna a solução do cromossomo; se o espaço de trabalho já decodificado for dado, não decodifica de novo"
+      if ws is None:
+        ws = self.build_terrain(chromosome, CrpWorkspace(self.instance))
+      return CrpSolucao.do_espaco(ws, self.calcula_custo(ws))
+
+    def draw_chart(self, chromosome, ws=None, filename="result.png"):
+      "Desenha os lotes (ver CrpSolucao.desenha)"
+      self.solucao(chromosome, ws).desenha(filename)
+
+
+    def get_culturas(self, permutacao):
+      """
+      Retorna as culturas de uma permutação inteira de índices do cromossomo,
+      de uma vez. Aceita uma lista ou um array NumPy (de qualquer forma, por
+      exemplo uma permutação por linha), e retorna do mesmo tipo.
+      """
+      if isinstance(permutacao, np.ndarray):
+        return self.instance.tabela_culturas[permutacao]
+      tabela = self.instance.cultura_por_indice
+      return [tabela[indice] for indice in permutacao]
+
+    def planta(self, ws, cultura,lote,tempo):
       "Planta a cultura começando no tempo indicado"
-      if cultura != self.instance.cultura_pousio:
-        duracao = self.instance.matriz_dados[cultura][2]
-      else:
-        duracao = self.instance.duracao_pousio
-      for i in range(duracao):
-        self.instance.terrenos[lote][self.wrap(tempo+i)] = cultura
-      return self.wrap(tempo + duracao)
+      tempo = self.wrap(tempo)
+      ws.adiciona(lote, tempo, cultura, self.instance.mascaras[cultura][tempo])
+      return self.wrap(tempo + self.instance.duracoes[cultura])
     
-    def desplanta(self, lote,tempo):
+    def desplanta(self, ws, lote,tempo):
       "Remove a cultura começando no tempo indicado"
-      cultura = self.instance.terrenos[lote][tempo]
+      ws.remove(lote, tempo)
 
-      if cultura != self.instance.cultura_pousio:
-        duracao = self.instance.matriz_dados[cultura][2]
-      else:
-        duracao = self.instance.duracao_pousio
-      for i in range(duracao):
-        self.instance.terrenos[lote][self.wrap(tempo+i)] = -1
-
-    def get_family(self, lote, tempo):
-      "Retorna a familia da cultura em dado lote e tempo"
-      if self.instance.terrenos[lote][tempo] == -1 or self.instance.terrenos[lote][tempo] == self.instance.cultura_pousio:
-        return -1
-      else:
-        return self.instance.matriz_dados[self.instance.terrenos[lote][tempo]][1]
-      
     def wrap(self, tempo):
       if tempo < 0:
         return tempo + self.instance.duracao_plantio
       else:
         return tempo % self.instance.duracao_plantio
 
-    def viabilidade(self, cultura,lote,tempo):
+    def viabilidade(self, ws, cultura,lote,tempo):
       "Retorna se é possível plantar a cultura no lote e tempo especificados"
-
-      duracao_cultura = self.instance.matriz_dados[cultura][2]
+      instance = self.instance
+      ciclo = instance.indice_ciclo
+      n = instance.duracao_plantio
+      familia = instance.familias[cultura]
+      mesma_familia = ws.familias[lote][familia]
 
       # Já tem cultura da mesma família antes ou depois
-      if self.instance.matriz_dados[cultura][1] == self.get_family(lote, self.wrap(tempo + duracao_cultura + 1)):
-          return False
-      elif self.instance.matriz_dados[cultura][1] == self.get_family(lote, self.wrap(tempo - 1)):
-          return False
-
-      for i in range(self.instance.matriz_dados[cultura][2]):
-        # Já tem algo plantado
-        if self.instance.terrenos[lote][self.wrap(tempo+i)] != -1:
-          return False
-        # Já tem cultura da mesma família no lote anterior
-        elif lote > 0 and self.get_family(lote-1, self.wrap(tempo+i)) == self.instance.matriz_dados[cultura][1]:
-          return False
+      if mesma_familia >> ciclo[tempo + instance.duracoes[cultura] + 1 + n] & 1:
+        return False
+      elif mesma_familia >> ciclo[tempo - 1 + n] & 1:
+        return False
+
+      mascara = instance.mascaras[cultura][ciclo[tempo + n]]
+      # Já tem algo plantado
+      if ws.ocupado[lote] & mascara:
+        return False
+      # Já tem cultura da mesma família no lote anterior
+      elif lote > 0 and ws.familias[lote-1][familia] & mascara:
+        return False
 
       return True
 
@@ -193,35 +513,10 @@ class CrpDecoder():
       "Retorna um inteiro de 0 a max-1"
       return math.ceil(float_number * max) - 1
 
-    def calcula_custo(self):
+    def calcula_custo(self, ws):
       "Calcula o custo total da solução"
-      custo = 0
-
-      for i in range(self.instance.numero_lotes):
-        cv = 0
-        for j in range(self.instance.duracao_plantio):
-          cultura_terreno = self.instance.terrenos[i][j]
-          #if cultura_terreno == -1 or (cultura_terreno >= self.instance.num_culturas_normais and cultura_terreno != self.instance.cultura_pousio):
-          if cultura_terreno == -1:
-            custo += 1
-          if cultura_terreno != self.instance.cultura_pousio and cultura_terreno >= self.instance.num_culturas_normais and cultura_terreno != self.instance.terrenos[i][self.wrap(j+1)]:
-            cv += 1
-        if cv != 1:
-          custo += 999999999
-      return custo
+      return sum(ws.custo_lote(i) for i in range(self.instance.numero_lotes))
     
-    def calcula_custo_lote(self, lote):
-      "Calcula o custo de um lote"
-      custo = 0
-
-      cv = 0
-      for j in range(self.instance.duracao_plantio):
-        cultura_terreno = self.instance.terrenos[lote][j]
-        #if cultura_terreno == -1 or (cultura_terreno >= self.instance.num_culturas_normais and cultura_terreno != self.instance.cultura_pousio):
-        if cultura_terreno == -1:
-          custo += 1
-        if cultura_terreno != self.instance.cultura_pousio and cultura_terreno >= self.instance.num_culturas_normais and cultura_terreno != self.instance.terrenos[lote][self.wrap(j+1)]:
-          cv += 1
-      if cv != 1:
-        custo += 999999999
-      return custo
+    def calcula_custo_batch(self, vazios, verdes):
+      "Calcula o custo total de um lote de soluções (matrizes solução x lote)"
+      return vazios.sum(axis=1) + 999999999 * np.count_nonzero(verdes != 1, axis=1)
@@ -1,4 +1,23 @@
-import pandas as pd
+import os
+
+import numpy as np
+
+# Parâmetros da instância que não estão na tabela de culturas, com os valores
+# usados quando não são dados (os de dados-ipo).
+PARAMETROS_PADRAO = {
+  "numero_lotes": 1,
+  "duracao_plantio": 72,
+  "num_culturas_verdes": 4,
+  "num_culturas_normais": 24,
+  "duracao_pousio": 3,
+}
+
+# Formato binário (.npy): um vetor int64 com o cabeçalho abaixo, seguido da
+# tabela de culturas (linha a linha) e de posicao_cultura. Os campos
+# derivados do cabeçalho valem para os parâmetros salvos junto.
+VERSAO_BINARIO = 1
+CABECALHO = (("versao",) + tuple(PARAMETROS_PADRAO)
+             + ("num_colunas", "cultura_verde", "min_duracao", "num_nodes"))
 
 class CrpInstance():
     """
@@ -9,41 +28,196 @@ class CrpInstance():
 
     posiçao 25-28 adubação verde
     cultura|familia|periodo de plantação
+
+    A instância é imutável depois de carregada, e pode ser compartilhada por
+    várias threads decodificando ao mesmo tempo. O estado de cada
+    decodificação fica em um ``CrpWorkspace``.
+
+    Pode ser lida de um CSV ou do formato binário gravado por
+    ``salva_binario`` (ver ``convert_instance.py``), que é lido sem pandas e
+    mapeado em memória. Ao ser enviada a outro processo, uma instância
+    binária é reaberta do arquivo em vez de copiada, e os processos
+    compartilham as páginas do arquivo.
     """
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, numero_lotes: int = None,
+                 duracao_plantio: int = None, num_culturas_verdes: int = None,
+                 num_culturas_normais: int = None, duracao_pousio: int = None):
         """
         Initializes the instance loading from a file.
+
+        Se filename termina em .npy, lê o formato binário; senão, lê
+        filename + '.csv'. O arquivo deve ter uma linha por cultura: primeiro
+        as num_culturas_normais culturas normais, depois as
+        num_culturas_verdes de adubação verde. Os parâmetros não dados vêm do
+        arquivo binário ou, para um CSV, de PARAMETROS_PADRAO.
         """
-        nome = filename + '.csv'
-        # Read the CSV file
-        culturas_dados = pd.read_csv(nome)
-        self.numero_lotes = 1
-        self.duracao_plantio = 72
-        self.num_culturas_verdes = 4
-        self.num_culturas_normais = 24
+        parametros = {
+          "numero_lotes": numero_lotes,
+          "duracao_plantio": duracao_plantio,
+          "num_culturas_verdes": num_culturas_verdes,
+          "num_culturas_normais": num_culturas_normais,
+          "duracao_pousio": duracao_pousio,
+        }
+        if filename.endswith('.npy'):
+          nome = os.path.abspath(filename)
+          matriz, salvos, derivados = self.le_binario(nome)
+        else:
+          nome = filename + '.csv'
+          matriz = self.le_csv(nome)
+          salvos, derivados = PARAMETROS_PADRAO, None
+        for parametro, valor in parametros.items():
+          if valor is None:
+            parametros[parametro] = salvos[parametro]
+        # Os campos derivados salvos só servem para os mesmos parâmetros.
+        if parametros != salvos:
+          derivados = None
+
+        if parametros["numero_lotes"] < 1 or parametros["duracao_plantio"] < 1:
+          raise ValueError(f"Número de lotes e duração do plantio devem ser "
+                           f"positivos. Dados {parametros['numero_lotes']} e "
+                           f"{parametros['duracao_plantio']}.")
+        if parametros["num_culturas_verdes"] < 1 or parametros["num_culturas_normais"] < 1:
+          raise ValueError(f"Deve haver ao menos uma cultura normal e uma verde. "
+                           f"Dados {parametros['num_culturas_normais']} e "
+                           f"{parametros['num_culturas_verdes']}.")
+        if parametros["num_culturas_normais"] + parametros["num_culturas_verdes"] != len(matriz):
+          raise ValueError(f"{nome} tem {len(matriz)} culturas, mas foram "
+                           f"pedidas {parametros['num_culturas_normais']} normais "
+                           f"e {parametros['num_culturas_verdes']} verdes.")
+        self.arquivo = nome
+        self.numero_lotes = parametros["numero_lotes"]
+        self.duracao_plantio = parametros["duracao_plantio"]
+        self.num_culturas_verdes = parametros["num_culturas_verdes"]
+        self.num_culturas_normais = parametros["num_culturas_normais"]
         self.cultura_pousio = self.num_culturas_normais + self.num_culturas_verdes
-        self.duracao_pousio = 3
-        self.matriz_dados = culturas_dados.values
-        self.terrenos = [[-1] * self.duracao_plantio for _ in range(self.numero_lotes)]
+        self.duracao_pousio = parametros["duracao_pousio"]
+        self.matriz_dados = matriz
+        self.matriz_dados.setflags(write=False)
         self.vetor_culturas_tam = 0
         self.posicao_cultura = []
-        self.min_duracao = min([cultura[2] for cultura in self.matriz_dados])
-        self.cultura_verde = min(self.matriz_dados[self.num_culturas_normais:], key = lambda c:c[2])[0] - 1
-        self.num_nodes = self.get_num_nodes()
+        self.cultura_por_indice = []
+        if derivados is None:
+          self.min_duracao = int(min([cultura[2] for cultura in self.matriz_dados]))
+          self.cultura_verde = int(min(self.matriz_dados[self.num_culturas_normais:], key = lambda c:c[2])[0] - 1)
+          self.num_nodes = self.get_num_nodes()
+        else:
+          self.cultura_verde, self.min_duracao, self.num_nodes, posicao_cultura = derivados
+          self.posicao_cultura.extend(posicao_cultura)
+          self.vetor_culturas_tam = self.posicao_cultura[-1]
+        self.monta_cultura_por_indice()
+        self.posicao_cultura = tuple(self.posicao_cultura)
+        self.cultura_por_indice = tuple(self.cultura_por_indice)
+        self.tabela_culturas = np.array(self.cultura_por_indice, dtype=int)
+        self.tabela_culturas.setflags(write=False)
+        self.precalcula_tabelas()
+        self._congelada = True
+
+    def __setattr__(self, name, value):
+      if getattr(self, "_congelada", False):
+        raise AttributeError(f"CrpInstance é somente leitura: '{name}'")
+      super().__setattr__(name, value)
+
+    def __copy__(self):
+      return self
+
+    def __deepcopy__(self, memo):
+      # Imutável: as cópias podem compartilhar o mesmo objeto.
+      return self
+
+    def __reduce_ex__(self, protocol):
+      # Uma instância binária é reaberta pelo outro processo, que mapeia o
+      # mesmo arquivo, em vez de receber uma cópia das tabelas.
+      if self.arquivo.endswith('.npy'):
+        return (CrpInstance, (self.arquivo, self.numero_lotes,
+                              self.duracao_plantio, self.num_culturas_verdes,
+                              self.num_culturas_normais, self.duracao_pousio))
+      return super().__reduce_ex__(protocol)
+
+    def le_csv(self, nome):
+      "Lê a tabela de culturas de um CSV"
+      import pandas as pd # Só é preciso para CSV, e demora para importar
+
+      return pd.read_csv(nome).to_numpy(copy=True)
+
+    def le_binario(self, nome):
+      """
+      Lê um arquivo gravado por salva_binario, mapeado em memória. Retorna a
+      tabela de culturas, os parâmetros salvos e os campos derivados
+      (cultura_verde, min_duracao, num_nodes e posicao_cultura).
+      """
+      dados = np.load(nome, mmap_mode='r')
+      if len(dados) < len(CABECALHO) or dados[0] != VERSAO_BINARIO:
+        raise ValueError(f"{nome} não é uma instância binária na versão "
+                         f"{VERSAO_BINARIO}.")
+      cabecalho = dict(zip(CABECALHO, (int(v) for v in dados[:len(CABECALHO)])))
+      salvos = {parametro: cabecalho[parametro] for parametro in PARAMETROS_PADRAO}
+      num_culturas = cabecalho["num_culturas_normais"] + cabecalho["num_culturas_verdes"]
+      inicio = len(CABECALHO)
+      fim = inicio + num_culturas * cabecalho["num_colunas"]
+      matriz = dados[inicio:fim].reshape(num_culturas, cabecalho["num_colunas"])
+      posicao_cultura = [int(v) for v in dados[fim:]]
+      if len(posicao_cultura) != cabecalho["num_culturas_normais"] + 1:
+        raise ValueError(f"{nome} está truncado.")
+      derivados = (cabecalho["cultura_verde"], cabecalho["min_duracao"],
+                   cabecalho["num_nodes"], posicao_cultura)
+      return matriz, salvos, derivados
+
+    def salva_binario(self, nome):
+      "Grava a instância no formato binário (.npy) lido por le_binario"
+      # Os outros campos do cabeçalho são atributos da instância.
+      extras = {"versao": VERSAO_BINARIO,
+                "num_colunas": self.matriz_dados.shape[1]}
+      cabecalho = [extras[campo] if campo in extras else getattr(self, campo)
+                   for campo in CABECALHO]
+      dados = np.concatenate([
+        np.array(cabecalho, dtype=np.int64),
+        np.asarray(self.matriz_dados, dtype=np.int64).ravel(),
+        np.array(self.posicao_cultura, dtype=np.int64)])
+      np.save(nome, dados)
 
     def get_num_nodes(self):
       soma=0
       for i in range(self.num_culturas_normais):
-        soma += self.duracao_plantio//self.matriz_dados[i][2] * self.numero_lotes // 2
+        soma += self.duracao_plantio//int(self.matriz_dados[i][2]) * self.numero_lotes // 2
         self.posicao_cultura.append(soma)
-      soma += self.duracao_plantio//self.matriz_dados[self.cultura_verde][2] * self.numero_lotes // 2
+      soma += self.duracao_plantio//int(self.matriz_dados[self.cultura_verde][2]) * self.numero_lotes // 2
       self.posicao_cultura.append(soma)
       self.vetor_culturas_tam=soma
       soma += self.numero_lotes
       return soma
-    
-    def reset(self):
-       for i in range(len(self.terrenos)):
-          for j in range(len(self.terrenos[i])):
-             self.terrenos[i][j] = -1
\ No newline at end of file
+
+    def monta_cultura_por_indice(self):
+      # Cultura de cada índice do vetor de culturas: os índices de
+      # posicao_cultura[i-1] a posicao_cultura[i]-1 são da cultura i.
+      inicio = 0
+      for i, fim in enumerate(self.posicao_cultura):
+        self.cultura_por_indice.extend([i] * (fim - inicio))
+        inicio = fim
+
+    def precalcula_tabelas(self):
+      """
+      Tabelas usadas no teste de viabilidade, calculadas uma vez na carga:
+      - duracoes[c] e familias[c]: duração e família de cada cultura, incluindo
+        o pousio (família -1);
+      - verdes[c]: se a cultura c é de adubação verde;
+      - indice_ciclo[t + duracao_plantio]: o tempo t trazido para o ciclo,
+        para t em [-duracao_plantio, 2 * duracao_plantio);
+      - mascaras[c][t]: máscara de bits dos tempos ocupados pela cultura c
+        plantada a partir do tempo t.
+      """
+      n = self.duracao_plantio
+      self.duracoes = tuple(int(c[2]) for c in self.matriz_dados) + (self.duracao_pousio,)
+      self.familias = tuple(int(c[1]) for c in self.matriz_dados) + (-1,)
+      self.verdes = tuple(self.num_culturas_normais <= c < self.cultura_pousio for c in range(self.cultura_pousio + 1))
+      self.num_familias = max(self.familias) + 1
+      self.indice_ciclo = tuple(t % n for t in range(-n, 2 * n))
+      self.mascaras = tuple(
+        tuple(self.mascara_intervalo(t, duracao) for t in range(n))
+        for duracao in self.duracoes)
+
+    def mascara_intervalo(self, tempo, duracao):
+      "Máscara de bits dos tempos [tempo, tempo + duracao) no ciclo"
+      n = self.duracao_plantio
+      mascara = ((1 << duracao) - 1) << tempo
+      return (mascara | (mascara >> n)) & ((1 << n) - 1)
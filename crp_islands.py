@@ -0,0 +1,272 @@
+import copy
+import multiprocessing
+
+from brkga_mp_ipr.enums import PathRelinkingResult, Sense
+
+from crp_brkga import CrpBrkgaMpIpr
+from crp_cache import FitnessCache
+from crp_decoder import CrpDecoder
+from crp_instance import CrpInstance
+from crp_stats import CrpStats
+
+def _run_island(connection, instance: CrpInstance, sense: Sense, seed: int,
+                params, cache_size: int, with_stats: bool, prune: bool,
+                evolutionary_mechanism_on: bool) -> None:
+    # Owns a single population and its decoder, and runs the commands sent
+    # by CrpIslands until it gets None. Each reply carries the best fitness
+    # of the island and, if any, the decoder counters, which start over.
+    decoder = CrpDecoder(instance, cache_size,
+                         CrpStats() if with_stats else None)
+    brkga = CrpBrkgaMpIpr(decoder=decoder, sense=sense, seed=seed,
+                          chromosome_size=instance.num_nodes, params=params,
+                          evolutionary_mechanism_on=evolutionary_mechanism_on,
+                          prune=prune)
+    initialized = False
+    while True:
+        command, args = connection.recv()
+        if command is None:
+            break
+
+        result = error = None
+        try:
+            if command == "warmup":
+                result = decoder.warmup(*args)
+            elif command == "cache_counters":
+                cache = decoder.cache
+                if cache is not None:
+                    result = (cache.hits, cache.misses, cache.evictions)
+            elif command == "path_relink":
+                # The distance function is the one of the island decoder.
+                pr_type, pr_selection, *rest = args
+                result = brkga.path_relink(pr_type, pr_selection,
+                                           decoder.distance, *rest)
+            else:
+                result = getattr(brkga, command)(*args)
+            initialized |= command == "initialize"
+        except Exception as exception:
+            error = exception
+
+        best = brkga.get_best_fitness() if initialized else None
+        stats = decoder.stats
+        if stats is not None:
+            decoder.stats = CrpStats()
+        connection.send((result, error, best, stats))
+    connection.close()
+
+class CrpIslands():
+    """
+    Island model of ``CrpBrkgaMpIpr``: each of the
+    ``params.num_independent_populations`` populations evolves in its own
+    process, with its own decoder and random number generator (island ``i``
+    is seeded with ``seed + i``). The islands only talk to this object,
+    through pipes, so they evolve in parallel and only meet when elite
+    chromosomes are exchanged.
+
+    It offers the methods of ``CrpBrkgaMpIpr`` used by the main loop, which
+    keeps the global best: each call is sent to all islands, which run it at
+    the same time, and the results are combined (the best fitness, the sum
+    of the chromosomes improved by local search, the union of the path
+    relinking results). ``exchange_elite()`` works as in ``CrpBrkgaMpIpr``,
+    with the elite chromosomes going through this process. The state of the
+    islands is saved and restored as a single dict of arrays, so runs can be
+    checkpointed as usual.
+
+    If ``stats`` is given, the terrain counters of the island decoders are
+    added to it after each call, and so is the decoding time of the island
+    that spent the longest decoding: the islands decode at the same time, so
+    that is the part of the wall time of the call spent decoding.
+    """
+
+    def __init__(self, instance: CrpInstance, sense: Sense, seed: int,
+                 params, cache_size: int = 0, stats: CrpStats = None,
+                 prune: bool = False, evolutionary_mechanism_on: bool = True):
+        self.num_islands = params.num_independent_populations
+        if self.num_islands < 1:
+            raise ValueError(f"Number of islands must be larger than zero. "
+                             f"Given {self.num_islands}.")
+
+        self.opt_sense = sense
+        self.stats = stats
+        self.cache_size = cache_size
+
+        island_params = copy.copy(params)
+        island_params.num_independent_populations = 1
+
+        self._best = [None] * self.num_islands
+        self._connections = []
+        self._processes = []
+        for i in range(self.num_islands):
+            connection, island_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_run_island, daemon=True,
+                args=(island_connection, instance, sense, seed + i,
+                      island_params, cache_size, stats is not None, prune,
+                      evolutionary_mechanism_on))
+            process.start()
+            island_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        for connection in self._connections:
+            connection.send((None, None))
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    ###########################################################################
+
+    def _call(self, commands: list) -> list:
+        """
+        Sends the (command, args) pairs, one per island (None skips the
+        island), and returns the results, after all islands are done.
+        """
+        for connection, command in zip(self._connections, commands):
+            if command is not None:
+                connection.send(command)
+
+        results = []
+        first_error = None
+        decode_time = 0.0
+        for i, connection in enumerate(self._connections):
+            if commands[i] is None:
+                results.append(None)
+                continue
+            result, error, best, stats = connection.recv()
+            self._best[i] = best
+            if stats is not None and self.stats is not None:
+                self.stats.merge(stats)
+                decode_time = max(decode_time, stats.decode_time)
+            if error is not None and first_error is None:
+                first_error = error
+            results.append(result)
+
+        if self.stats is not None:
+            self.stats.record_decode(decode_time)
+        if first_error is not None:
+            raise first_error
+        return results
+
+    def _broadcast(self, command: str, *args) -> list:
+        return self._call([(command, args)] * self.num_islands)
+
+    def _best_island(self) -> int:
+        if self.opt_sense == Sense.MINIMIZE:
+            return min(range(self.num_islands), key=self._best.__getitem__)
+        return max(range(self.num_islands), key=self._best.__getitem__)
+
+    ###########################################################################
+
+    def initialize(self) -> None:
+        self._broadcast("initialize")
+
+    def warmup(self, num_chromosomes: int = 20, seed: int = 0) -> float:
+        """
+        Warms up the decoder of each island (see ``CrpDecoder.warmup()``),
+        and returns the longest time spent, in seconds.
+        """
+        return max(self._broadcast("warmup", num_chromosomes, seed))
+
+    def evolve(self, num_generations: int = 1) -> None:
+        self._broadcast("evolve", num_generations)
+
+    def local_search(self, num_individuals: int = 1,
+                     max_time: float = 0) -> int:
+        return sum(self._broadcast("local_search", num_individuals, max_time))
+
+    def path_relink(self, pr_type, pr_selection, dist: callable,
+                    number_pairs: int, minimum_distance: float,
+                    block_size: int = 1, max_time: int = 0,
+                    percentage: float = 1.0) -> PathRelinkingResult:
+        """
+        See ``CrpBrkgaMpIpr.path_relink()``. ``dist`` is not sent to the
+        islands, which use the distance of their own decoder. A
+        ``BEST_IMPROVEMENT`` is an improvement of the best chromosome of an
+        island, which may not be the global best.
+        """
+        final_status = PathRelinkingResult.TOO_HOMOGENEOUS
+        for status in self._broadcast("path_relink", pr_type, pr_selection,
+                                      number_pairs, minimum_distance,
+                                      block_size, max_time, percentage):
+            final_status |= status
+        return final_status
+
+    def exchange_elite(self, num_immigrants: int) -> None:
+        """
+        Sends the ``num_immigrants`` best chromosomes of each island, with
+        their fitness values, to all the other islands, where they replace
+        the worst chromosomes.
+        """
+        if num_immigrants < 1:
+            raise ValueError(f"Number of immigrants must be larger than "
+                             f"zero. Given {num_immigrants}.")
+
+        emigrants = self._broadcast("get_elite", num_immigrants)
+        self._call([("add_immigrants",
+                     ([immigrant for j, elite in enumerate(emigrants)
+                       if j != i for immigrant in elite],))
+                    for i in range(self.num_islands)])
+
+    ###########################################################################
+
+    def get_best_fitness(self) -> float:
+        return self._best[self._best_island()]
+
+    def get_best_chromosome(self):
+        island = self._best_island()
+        commands = [("get_best_chromosome", ()) if i == island else None
+                    for i in range(self.num_islands)]
+        return self._call(commands)[island]
+
+    def get_cache(self) -> FitnessCache:
+        """
+        Returns a cache holding the total hits, misses and evictions of the
+        island caches (not their items), or None if there is no cache.
+        """
+        if self.cache_size <= 0:
+            return None
+        cache = FitnessCache(self.cache_size)
+        for hits, misses, evictions in self._broadcast("cache_counters"):
+            cache.hits += hits
+            cache.misses += misses
+            cache.evictions += evictions
+        return cache
+
+    def get_fitness_values(self) -> list:
+        return [value for values in self._broadcast("get_fitness_values")
+                for value in values]
+
+    def get_state(self) -> dict:
+        """
+        Returns the states of the islands (see ``CrpBrkgaMpIpr.get_state()``)
+        in a single dict, with the arrays of island ``i`` prefixed by
+        ``island<i>_``.
+        """
+        return {f"island{i}_{name}": value
+                for i, state in enumerate(self._broadcast("get_state"))
+                for name, value in state.items()}
+
+    def set_state(self, state: dict) -> None:
+        states = [{} for _ in range(self.num_islands)]
+        for key, value in state.items():
+            prefix, _, name = key.partition("_")
+            i = int(prefix[len("island"):]) \
+                if prefix.startswith("island") else -1
+            if not 0 <= i < self.num_islands:
+                raise ValueError(f"Expected the state of "
+                                 f"{self.num_islands} islands. "
+                                 f"Given {key}.")
+            states[i][name] = value
+        if not all(states):
+            raise ValueError(f"Expected the state of {self.num_islands} "
+                             f"islands. Given {len([s for s in states if s])}.")
+        self._call([("set_state", (island_state,))
+                    for island_state in states])
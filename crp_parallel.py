@@ -0,0 +1,180 @@
+import multiprocessing
+import time
+
+import numpy as np
+
+from crp_instance import CrpInstance
+from crp_decoder import CrpDecoder
+from crp_stats import CrpStats
+
+# Decoder owned by each worker process. It is built once, when the worker
+# starts, from its own copy of the instance.
+_worker_decoder = None
+
+def _init_worker(instance: CrpInstance, with_stats: bool) -> None:
+    global _worker_decoder
+    _worker_decoder = CrpDecoder(instance,
+                                 stats=CrpStats() if with_stats else None)
+
+def _decode_chunk(chromosomes: np.ndarray, bound) -> tuple:
+    # The worker's counters go back with the values, and start over.
+    _worker_decoder.bound = bound
+    values = _worker_decoder.decode_batch(chromosomes)
+    stats = _worker_decoder.stats
+    if stats is not None:
+        _worker_decoder.stats = CrpStats()
+    return values, stats
+
+class CrpParallelDecoder():
+    """
+    Decodes populations using a pool of worker processes. Each worker owns a
+    private copy of the instance and, therefore, its own terrain scratch
+    buffers. Chromosomes are sent to the workers in chunks, and the fitness
+    values are exactly the same as the ones from the serial decoder.
+
+    The fitness cache, if any, lives in the parent process: only the
+    chromosomes whose crop order is not cached are sent to the workers.
+
+    If ``stats`` is given, the terrain counters of the workers are added to
+    it after each batch.
+
+    ``bound`` works as in ``CrpDecoder``, and is sent to the workers with
+    each batch.
+    """
+
+    def __init__(self, instance: CrpInstance, num_workers: int,
+                 chunks_per_worker: int = 2, cache_size: int = 0,
+                 stats: CrpStats = None):
+        if num_workers < 1:
+            raise ValueError(f"Number of workers must be larger than zero. "
+                             f"Given {num_workers}.")
+
+        self.instance = instance
+        self.num_workers = num_workers
+        self.chunks_per_worker = chunks_per_worker
+
+        # Used for single decodes, which are not worth sending to the pool.
+        # It also holds the fitness cache.
+        self.serial = CrpDecoder(instance, cache_size, stats)
+        self.cache = self.serial.cache
+        self.stats = stats
+        self.pool = multiprocessing.Pool(num_workers,
+                                         initializer=_init_worker,
+                                         initargs=(instance,
+                                                   stats is not None))
+
+    @property
+    def bound(self):
+        return self.serial.bound
+
+    @bound.setter
+    def bound(self, value):
+        # Single decodes are done by the serial decoder.
+        self.serial.bound = value
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
+
+    ###########################################################################
+    def decode(self, chromosome, rewrite: bool) -> float:
+        return self.serial.decode(chromosome, rewrite)
+
+    def warmup(self, num_chromosomes: int = 20, seed: int = 0) -> float:
+        """
+        Warms up this process as ``CrpDecoder.warmup()`` does, and the
+        workers with a batch of random chromosomes, which skips the cache.
+        Returns the time spent, in seconds.
+        """
+        start_time = time.perf_counter()
+        self.serial.warmup(num_chromosomes, seed)
+        num_chromosomes = max(num_chromosomes,
+                              self.num_workers * self.chunks_per_worker)
+        chaves = np.random.default_rng(seed).random(
+            (num_chromosomes, self.instance.num_nodes))
+        self._decode_pool(chaves)
+        return time.perf_counter() - start_time
+
+    ###########################################################################
+    def decode_batch(self, chromosomes) -> np.ndarray:
+        if self.stats is not None:
+            start_time = time.perf_counter()
+
+        values = self._decode_batch(chromosomes)
+
+        if self.stats is not None:
+            self.stats.record_decode(time.perf_counter() - start_time)
+        return values
+
+    def _decode_batch(self, chromosomes) -> np.ndarray:
+        chaves = np.asarray(chromosomes, dtype=float)
+        if self.cache is None:
+            return self._decode_pool(chaves)
+
+        culturas, tempos_ini = self.serial.prepara_batch(chaves)
+        keys = [(tuple(lista_culturas), tuple(tempos))
+                for lista_culturas, tempos in zip(culturas, tempos_ini)]
+        values = np.empty(len(keys), dtype=int)
+        missing = []
+        for i, key in enumerate(keys):
+            value = self.cache.get(key)
+            if value is None:
+                missing.append(i)
+            else:
+                values[i] = value
+
+        if missing:
+            values[missing] = self._decode_pool(chaves[missing])
+            for i in missing:
+                # Values above the bound may be partial costs.
+                if self.bound is None or values[i] <= self.bound:
+                    self.cache.put(keys[i], int(values[i]))
+        return values
+
+    def _decode_pool(self, chaves: np.ndarray) -> np.ndarray:
+        num_chunks = max(1, min(len(chaves),
+                                self.num_workers * self.chunks_per_worker))
+        chunks = np.array_split(chaves, num_chunks)
+        results = self.pool.starmap(_decode_chunk,
+                                    [(chunk, self.bound) for chunk in chunks])
+        if self.stats is not None:
+            for _, stats in results:
+                self.stats.merge(stats)
+        return np.concatenate([values for values, _ in results])
+
+    ###########################################################################
+    # Path relinking and local moves decode one neighbor at a time, reusing
+    # the terrain of the previous one, so they run in this process.
+
+    def decodifica_ordem(self, chromosome):
+        return self.serial.decodifica_ordem(chromosome)
+
+    def relink_base(self, lista_culturas, tempos_ini):
+        return self.serial.relink_base(lista_culturas, tempos_ini)
+
+    def decode_relink(self, trilha, lista_culturas, tempos_ini,
+                      posicao: int) -> int:
+        return self.serial.decode_relink(trilha, lista_culturas, tempos_ini,
+                                         posicao)
+
+    def decode_swaps(self, trilha, trocas, tempos_ini=None) -> int:
+        return self.serial.decode_swaps(trilha, trocas, tempos_ini)
+
+    def equivalentes(self, cultura1, cultura2):
+        return self.serial.equivalentes(cultura1, cultura2)
+
+    def distance(self, chromosome1, chromosome2) -> float:
+        return self.serial.distance(chromosome1, chromosome2)
+
+    ###########################################################################
+    def solucao(self, chromosome):
+        return self.serial.solucao(chromosome)
+
+    def draw_chart(self, chromosome):
+        self.serial.draw_chart(chromosome)
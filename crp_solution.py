@@ -0,0 +1,119 @@
+import csv
+import json
+
+class CrpSolucao():
+    """
+    Solução decodificada: as culturas plantadas em cada lote, sem depender
+    do espaço de trabalho nem do decodificador.
+
+    lotes[i] é a lista ordenada de (início, duração, cultura, família) das
+    culturas plantadas no lote i, com os índices internos da instância (o
+    pousio tem família -1); uma cultura que começa perto do fim do ciclo
+    pode passar do horizonte e continuar no começo do lote.
+
+    A solução pode ser salva em JSON (e lida de volta por ``carrega``),
+    exportada em CSV, com a numeração das culturas e dos lotes do arquivo da
+    instância, e desenhada, tudo numa única passada pelos intervalos.
+    """
+
+    def __init__(self, lotes, duracao_plantio: int, custo: int):
+        self.lotes = [[tuple(intervalo) for intervalo in lote] for lote in lotes]
+        self.duracao_plantio = duracao_plantio
+        self.custo = custo
+
+    @classmethod
+    def do_espaco(cls, ws, custo: int) -> "CrpSolucao":
+      "Retorna a solução que está no espaço de trabalho dado"
+      instance = ws.instance
+      lotes = [[(inicio, instance.duracoes[cultura], cultura, instance.familias[cultura])
+                for inicio, cultura in intervalos]
+               for intervalos in ws.intervalos]
+      return cls(lotes, instance.duracao_plantio, custo)
+
+    @classmethod
+    def carrega(cls, filename: str) -> "CrpSolucao":
+      "Lê a solução salva por salva_json"
+      with open(filename, "r", encoding="utf-8") as hd:
+        dados = json.load(hd)
+      return cls(dados["lotes"], dados["duracao_plantio"], dados["custo"])
+
+    ###########################################################################
+    def segmentos(self, lote):
+      """
+      Retorna o lote como a lista de (início, comprimento, cultura) dos
+      trechos do horizonte, na ordem, com os vazios (cultura -1) e a parte
+      de uma cultura que dá a volta no ciclo; trechos vizinhos com a mesma
+      cultura são juntados.
+      """
+      n = self.duracao_plantio
+      intervalos = self.lotes[lote]
+      segmentos = []
+
+      def acrescenta(inicio, comprimento, cultura):
+        if segmentos and segmentos[-1][2] == cultura and sum(segmentos[-1][:2]) == inicio:
+          segmentos[-1] = (segmentos[-1][0], segmentos[-1][1] + comprimento, cultura)
+        else:
+          segmentos.append((inicio, comprimento, cultura))
+
+      tempo = 0
+      if intervalos:
+        inicio, duracao, cultura, _ = intervalos[-1]
+        if inicio + duracao > n:
+          tempo = inicio + duracao - n
+          acrescenta(0, tempo, cultura)
+      for inicio, duracao, cultura, _ in intervalos:
+        if inicio > tempo:
+          acrescenta(tempo, inicio - tempo, -1)
+        acrescenta(inicio, min(duracao, n - inicio), cultura)
+        tempo = inicio + duracao
+      if tempo < n:
+        acrescenta(tempo, n - tempo, -1)
+      return segmentos
+
+    def para_dict(self) -> dict:
+      return {"custo": self.custo,
+              "duracao_plantio": self.duracao_plantio,
+              "lotes": [[list(intervalo) for intervalo in lote] for lote in self.lotes]}
+
+    def salva_json(self, filename: str) -> None:
+      with open(filename, "w", encoding="utf-8") as hd:
+        json.dump(self.para_dict(), hd)
+
+    def salva_csv(self, filename: str) -> None:
+      "Uma linha por cultura plantada; lotes e culturas numerados a partir de 1, como no arquivo da instância"
+      with open(filename, "w", encoding="utf-8", newline="") as hd:
+        writer = csv.writer(hd)
+        writer.writerow(["lote", "inicio", "duracao", "cultura", "familia"])
+        for lote, intervalos in enumerate(self.lotes):
+          for inicio, duracao, cultura, familia in intervalos:
+            writer.writerow([lote + 1, inicio, duracao, cultura + 1,
+                             familia + 1 if familia >= 0 else ""])
+
+    def salva(self, filename: str) -> None:
+      "Salva em CSV, se o nome terminar em .csv, ou em JSON"
+      if filename.endswith(".csv"):
+        self.salva_csv(filename)
+      else:
+        self.salva_json(filename)
+
+    def desenha(self, filename: str = "result.png") -> None:
+      "Desenha os lotes, com o número de cada cultura (0 nos tempos vazios)"
+      # Importado só aqui: o matplotlib demora para carregar, e o desenho só
+      # é feito uma vez, no fim.
+      import matplotlib.pyplot as plt
+
+      numero_lotes = len(self.lotes)
+      fig, ax = plt.subplots()
+      for i in range(numero_lotes):
+        segmentos = self.segmentos(i)
+        ax.broken_barh([(inicio, comprimento) for inicio, comprimento, _ in segmentos],
+                       (i+0.5, 1), facecolor='white', edgecolor='black')
+        for inicio, comprimento, cultura in segmentos:
+          ax.text(inicio + comprimento/2, i+1, str(cultura+1), va = 'center', ha = 'center', size = 'small')
+      ax.set_ylim(0.5, numero_lotes + 0.5)
+      ax.set_xlim(0, self.duracao_plantio)
+      ax.set_yticks([k for k in range(1, numero_lotes+1)])
+      ax.set_xticks([k for k in range(0, self.duracao_plantio, 10)])
+
+      plt.savefig(filename)
+      plt.close(fig)
@@ -0,0 +1,188 @@
+import json
+import time
+
+# Latency histogram: bucket k counts the decodes that took from 2^(k-1) to
+# 2^k microseconds (bucket 0 is below 1 us, the last one is unbounded).
+NUM_BUCKETS = 24
+
+class CrpStats():
+    """
+    Opt-in counters and timers of the hot paths.
+
+    The decoders and the algorithm hold a ``stats`` attribute that is None by
+    default; when it is None, the only overhead is that check. When it is a
+    ``CrpStats``, they record:
+    - each terrain built: count, latency (histogram), the time spent in
+      the first and second passes, and whether it was cut short by the
+      decoder's bound;
+    - the wall time spent in the decoder entry points (``decode`` and
+      ``decode_batch``), which is the decoding time seen by the algorithm;
+    - for each generation: the time of ``evolve()`` and how much of it was
+      spent decoding, and, apart, the decodes done after it, by the local
+      search and path relinking (their re-decodes of the chromosomes they
+      changed).
+
+    The neighbours evaluated by ``decode_swaps`` and ``decode_relink`` are
+    not counted: they are not decodes of whole chromosomes.
+
+    Each generation produces a record with the increments of the counters.
+    Records are written as JSON lines to ``trace_file``, if given (added to
+    the end of the file if ``append`` is True), and a summary line is
+    printed every ``interval`` generations, if positive.
+    """
+
+    def __init__(self, interval: int = 0, trace_file: str = None,
+                 append: bool = False):
+        self.interval = interval
+        self.trace = open(trace_file, "a" if append else "w",
+                          encoding="utf-8") if trace_file else None
+        self._generation_start = 0.0
+        self._evolve_time = 0.0
+        self.reset()
+
+    def reset(self) -> None:
+        self.num_decodes = 0
+        self.num_pruned = 0
+        self.terrain_time = 0.0
+        self.first_pass_time = 0.0
+        self.second_pass_time = 0.0
+        self.decode_time = 0.0
+        self.histogram = [0] * NUM_BUCKETS
+        self.num_generations = 0
+        self.evolve_time = 0.0
+        self.evolve_decode_time = 0.0
+        self._last = self.counters()
+        self._evolved = self._last
+
+    def close(self) -> None:
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def __getstate__(self):
+        # Only the counters go to worker processes or back from them.
+        state = self.__dict__.copy()
+        state["trace"] = None
+        return state
+
+    ###########################################################################
+
+    def record_terrain(self, first_pass: float, second_pass: float,
+                       pruned: bool = False) -> None:
+        """
+        Records a terrain built in ``first_pass + second_pass`` seconds.
+        """
+        total = first_pass + second_pass
+        self.num_decodes += 1
+        self.num_pruned += pruned
+        self.terrain_time += total
+        self.first_pass_time += first_pass
+        self.second_pass_time += second_pass
+        bucket = min(int(total * 1e6).bit_length(), NUM_BUCKETS - 1)
+        self.histogram[bucket] += 1
+
+    def record_decode(self, seconds: float) -> None:
+        """
+        Records the wall time of a call to a decoder entry point.
+        """
+        self.decode_time += seconds
+
+    def merge(self, other: "CrpStats") -> None:
+        """
+        Adds the terrain counters of ``other`` (e.g., from a worker process).
+        """
+        self.num_decodes += other.num_decodes
+        self.num_pruned += other.num_pruned
+        self.terrain_time += other.terrain_time
+        self.first_pass_time += other.first_pass_time
+        self.second_pass_time += other.second_pass_time
+        for k, count in enumerate(other.histogram):
+            self.histogram[k] += count
+
+    ###########################################################################
+
+    def counters(self) -> dict:
+        return {
+            "decodes": self.num_decodes,
+            "pruned": self.num_pruned,
+            "decode_time": self.decode_time,
+            "first_pass_time": self.first_pass_time,
+            "second_pass_time": self.second_pass_time,
+        }
+
+    def start_generation(self) -> None:
+        self._generation_start = time.perf_counter()
+
+    def end_evolve(self) -> None:
+        """
+        Marks the end of the ``evolve()`` of the generation started by
+        ``start_generation()``. Decodes from here to ``end_generation()``
+        are the ones of the local search and path relinking.
+        """
+        self._evolve_time = time.perf_counter() - self._generation_start
+        self._evolved = self.counters()
+
+    def end_generation(self, iteration: int, best_cost: float) -> dict:
+        """
+        Closes the generation started by ``start_generation()``, and returns
+        its record, which is also written to the trace file and, if it is
+        time, printed. ``decodes`` and ``decode_time`` are the ones of
+        ``evolve()``; ``search_decodes`` and ``search_decode_time``, the
+        ones after ``end_evolve()``.
+        """
+        evolve_time = self._evolve_time
+        self.num_generations += 1
+        self.evolve_time += evolve_time
+
+        current = self.counters()
+        record = {"iteration": iteration, "best_cost": best_cost,
+                  "evolve_time": evolve_time}
+        for name, value in self._evolved.items():
+            record[name] = value - self._last[name]
+        record["other_time"] = evolve_time - record["decode_time"]
+        record["search_decodes"] = \
+            current["decodes"] - self._evolved["decodes"]
+        record["search_decode_time"] = \
+            current["decode_time"] - self._evolved["decode_time"]
+        self.evolve_decode_time += record["decode_time"]
+        self._last = current
+
+        if self.trace is not None:
+            self.trace.write(json.dumps(record) + "\n")
+        if self.interval > 0 and self.num_generations % self.interval == 0:
+            print(f"# {self.summary()}", flush=True)
+        return record
+
+    ###########################################################################
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Upper bound, in microseconds, of the given fraction of the decode
+        latencies, from the histogram.
+        """
+        target = fraction * self.num_decodes
+        total = 0
+        for k, count in enumerate(self.histogram):
+            total += count
+            if count and total >= target:
+                return float(2 ** k)
+        return 0.0
+
+    def summary(self) -> str:
+        mean = self.terrain_time / self.num_decodes * 1e6 \
+            if self.num_decodes else 0.0
+        passes = self.first_pass_time + self.second_pass_time
+        first_share = self.first_pass_time / passes if passes else 0.0
+        decode_share = self.evolve_decode_time / self.evolve_time \
+            if self.evolve_time else 0.0
+        pruned_share = self.num_pruned / self.num_decodes \
+            if self.num_decodes else 0.0
+        return (f"generations {self.num_generations} | "
+                f"decodes {self.num_decodes} "
+                f"({pruned_share:.0%} pruned) | "
+                f"latency mean {mean:.0f} us, "
+                f"p50 <{self.percentile(0.5):.0f} us, "
+                f"p99 <{self.percentile(0.99):.0f} us | "
+                f"first/second pass {first_share:.0%}/{1 - first_share:.0%} | "
+                f"evolve {self.evolve_time:.2f} s, "
+                f"decoding {decode_share:.0%}")
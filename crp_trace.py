@@ -0,0 +1,92 @@
+import csv
+import json
+import time
+
+class CrpTrace():
+    """
+    Buffered writer of per-generation records (dicts), as JSON lines or, if
+    the file name ends with ``.csv``, as CSV. Files are UTF-8.
+
+    Records are kept in memory and written in batches, when ``batch_size``
+    records are pending or ``flush_interval`` seconds have passed since the
+    last write, and at ``close()``. So the optimization loop does not wait on
+    the disk at every generation. The CSV columns are the keys of the first
+    record; keys that show up only later are left out.
+    """
+
+    def __init__(self, filename: str, batch_size: int = 100,
+                 flush_interval: float = 5.0, append: bool = False):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.is_csv = filename.endswith(".csv")
+        self._file = open(filename, "a" if append else "w", encoding="utf-8",
+                          newline="")
+        self._writer = None
+        self._pending = []
+        self._last_flush = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, record: dict) -> None:
+        self._pending.append(record)
+        if len(self._pending) >= self.batch_size or \
+           time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            if self.is_csv:
+                if self._writer is None:
+                    self._writer = csv.DictWriter(
+                        self._file, fieldnames=list(self._pending[0]),
+                        extrasaction="ignore")
+                    if self._file.tell() == 0:
+                        self._writer.writeheader()
+                self._writer.writerows(self._pending)
+            else:
+                self._file.write("".join(json.dumps(record) + "\n"
+                                         for record in self._pending))
+            self._pending.clear()
+            self._file.flush()
+        self._last_flush = time.time()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+###############################################################################
+
+def read_trace(filename: str):
+    """
+    Yields the records of a trace written by ``CrpTrace`` (or of any JSON
+    lines file), one at a time, without loading the whole file. CSV values
+    are converted to int or float when possible. A last line left
+    incomplete by an interrupted run is skipped.
+    """
+    with open(filename, "r", encoding="utf-8", newline="") as hd:
+        if filename.endswith(".csv"):
+            for row in csv.DictReader(hd):
+                if None in row.values():
+                    break
+                yield {name: _parse_number(value)
+                       for name, value in row.items()}
+        else:
+            for line in hd:
+                if not line.endswith("\n"):
+                    break
+                yield json.loads(line)
+
+def _parse_number(value: str):
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
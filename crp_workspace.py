@@ -0,0 +1,206 @@
+from bisect import bisect_left, bisect_right, insort
+from crp_instance import CrpInstance
+
+class CrpWorkspace():
+    """
+    Espaço de trabalho de uma decodificação: os lotes sendo preenchidos.
+
+    A instância é só leitura e pode ser compartilhada; cada thread ou
+    processo que decodifica usa o seu próprio espaço de trabalho, que é
+    reaproveitado entre decodificações.
+
+    Cada lote é guardado de forma compacta:
+    - ocupado[lote]: máscara de bits cíclica dos tempos ocupados;
+    - familias[lote][f]: máscara de bits dos tempos ocupados pela família f
+      (o pousio não tem família);
+    - intervalos[lote]: lista ordenada de (início, cultura) das culturas
+      plantadas;
+    - num_vazios[lote] e num_verdes[lote]: contadores de tempos vazios e de
+      blocos de adubação verde, mantidos a cada plantio e remoção, de onde
+      sai o custo do lote.
+    """
+
+    def __init__(self, instance: CrpInstance):
+        self.instance = instance
+        self.ocupado = [0] * instance.numero_lotes
+        self.familias = [[0] * instance.num_familias for _ in range(instance.numero_lotes)]
+        self.intervalos = [[] for _ in range(instance.numero_lotes)]
+        self.num_vazios = [instance.duracao_plantio] * instance.numero_lotes
+        self.num_verdes = [0] * instance.numero_lotes
+        self.fila = CrpFila(instance)
+
+    def reset(self):
+      for i in range(self.instance.numero_lotes):
+        self.limpa_lote(i)
+
+    def limpa_lote(self, lote):
+      "Esvazia o lote"
+      self.ocupado[lote] = 0
+      self.familias[lote] = [0] * self.instance.num_familias
+      self.intervalos[lote] = []
+      self.num_vazios[lote] = self.instance.duracao_plantio
+      self.num_verdes[lote] = 0
+
+    def adiciona(self, lote, tempo, cultura, mascara):
+      "Registra a cultura plantada no tempo (já no ciclo) com a máscara dada"
+      if self.instance.verdes[cultura]:
+        self.num_verdes[lote] += self.variacao_verdes(lote, tempo, cultura)
+      self.ocupado[lote] |= mascara
+      if cultura != self.instance.cultura_pousio:
+        self.familias[lote][self.instance.familias[cultura]] |= mascara
+      insort(self.intervalos[lote], (tempo, cultura))
+      self.num_vazios[lote] -= self.instance.duracoes[cultura]
+
+    def remove(self, lote, tempo):
+      "Remove a cultura que começa no tempo dado e a retorna"
+      intervalos = self.intervalos[lote]
+      k = bisect_right(intervalos, (tempo, self.instance.cultura_pousio)) - 1
+      inicio, cultura = intervalos.pop(k)
+      mascara = self.instance.mascaras[cultura][inicio]
+      self.ocupado[lote] &= ~mascara
+      if cultura != self.instance.cultura_pousio:
+        self.familias[lote][self.instance.familias[cultura]] &= ~mascara
+      self.num_vazios[lote] += self.instance.duracoes[cultura]
+      if self.instance.verdes[cultura]:
+        self.num_verdes[lote] -= self.variacao_verdes(lote, inicio, cultura)
+      return cultura
+
+    def variacao_verdes(self, lote, tempo, cultura):
+      """
+      Variação no número de blocos de adubação verde ao plantar a cultura no
+      tempo dado: um bloco novo, menos os blocos vizinhos da mesma cultura
+      aos quais ele se junta.
+      """
+      n = self.instance.duracao_plantio
+      variacao = 1
+      if self.cultura_em(lote, (tempo - 1) % n) == cultura:
+        variacao -= 1
+      if self.cultura_em(lote, (tempo + self.instance.duracoes[cultura]) % n) == cultura:
+        variacao -= 1
+      return variacao
+
+    def livre(self, lote, tempo):
+      "Retorna se o tempo (já no ciclo) está livre no lote"
+      return not self.ocupado[lote] >> tempo & 1
+
+    def custo_lote(self, lote):
+      "Custo do lote: tempos vazios, mais a penalidade se não houver exatamente um bloco de adubação verde"
+      if self.num_verdes[lote] != 1:
+        return self.num_vazios[lote] + 999999999
+      return self.num_vazios[lote]
+
+    def cultura_em(self, lote, tempo):
+      "Retorna a cultura plantada no lote e tempo (já no ciclo), ou -1"
+      if self.livre(lote, tempo):
+        return -1
+      intervalos = self.intervalos[lote]
+      # A cultura que começa antes do tempo ou, se nenhuma, a que dá a volta
+      # no ciclo, que é a última da lista.
+      k = bisect_right(intervalos, (tempo, self.instance.cultura_pousio))
+      return intervalos[k - 1][1]
+
+    def terreno(self, lote):
+      "Retorna o lote como uma lista com a cultura de cada tempo (-1 se vazio)"
+      n = self.instance.duracao_plantio
+      terreno = [-1] * n
+      for inicio, cultura in self.intervalos[lote]:
+        for t in range(inicio, inicio + self.instance.duracoes[cultura]):
+          terreno[t % n] = cultura
+      return terreno
+
+    def salva_lote(self, lote):
+      "Retorna uma cópia do estado do lote"
+      return (self.ocupado[lote], list(self.familias[lote]), list(self.intervalos[lote]),
+              self.num_vazios[lote], self.num_verdes[lote])
+
+    def restaura_lote(self, lote, estado):
+      "Restaura o estado do lote salvo por salva_lote (o estado passa a ser usado pelo lote)"
+      self.ocupado[lote], familias, intervalos, self.num_vazios[lote], self.num_verdes[lote] = estado
+      self.familias[lote] = familias
+      self.intervalos[lote] = intervalos
+
+    def copia_lote(self, lote, estado):
+      "Restaura o estado do lote salvo por salva_lote, que continua valendo"
+      ocupado, familias, intervalos, num_vazios, num_verdes = estado
+      self.restaura_lote(lote, (ocupado, list(familias), list(intervalos), num_vazios, num_verdes))
+
+class CrpFila():
+    """
+    Fila das culturas ainda não plantadas, na ordem dada pelo cromossomo.
+
+    As culturas que não cabem em um lote continuam na fila na mesma ordem
+    relativa, e todas as ocorrências de uma cultura são equivalentes para a
+    viabilidade. Por isso a fila é guardada como uma lista ordenada de
+    posições para cada cultura (as culturas verdes formam uma só classe,
+    cultura_verde): achar a próxima cultura viável depois de uma posição
+    custa uma busca binária por cultura, e não uma varredura da fila inteira.
+    """
+
+    def __init__(self, instance: CrpInstance):
+        self.instance = instance
+        self.classes = tuple(range(instance.num_culturas_normais)) + (instance.cultura_verde,)
+        # Classe de cada cultura: ela mesma, ou cultura_verde se for verde
+        self.classe = tuple(instance.cultura_verde if instance.verdes[c] else c
+                            for c in range(instance.cultura_pousio + 1))
+        self.posicoes = [[] for _ in range(instance.cultura_pousio + 1)]
+        # Índice, na lista de posições da classe, da ocorrência sendo
+        # examinada (usado por CrpDecoder.planta_lista)
+        self.indice = [0] * (instance.cultura_pousio + 1)
+        self.tamanho = 0
+
+    def reset(self, lista_culturas):
+      posicoes = self.posicoes
+      classe = self.classe
+      for c in self.classes:
+        posicoes[c].clear()
+      for posicao, cultura in enumerate(lista_culturas):
+        posicoes[classe[cultura]].append(posicao)
+      self.tamanho = len(lista_culturas)
+
+    def append(self, cultura):
+      "Põe a cultura no fim da fila"
+      self.posicoes[self.classe[cultura]].append(self.tamanho)
+      self.tamanho += 1
+
+    def pop(self, cultura):
+      "Tira do fim da fila a cultura posta por append"
+      self.posicoes[self.classe[cultura]].pop()
+      self.tamanho -= 1
+
+    def insere(self, classe, posicao):
+      "Devolve uma ocorrência removida à sua posição"
+      insort(self.posicoes[classe], posicao)
+
+    def retira(self, classe, posicao):
+      "Retira a ocorrência da classe na posição dada"
+      lista = self.posicoes[classe]
+      del lista[bisect_left(lista, posicao)]
+
+class CrpTrilha():
+    """
+    Registro da primeira passada de uma decodificação, usado pelo path
+    relinking e pela busca local para decodificar soluções vizinhas sem
+    refazer tudo.
+
+    Para cada lote i, guarda o estado do lote depois da sua primeira passada
+    (estados[i]), as culturas retiradas da fila por ela (plantadas[i], pares
+    (classe, posição)) e a maior posição da fila examinada (fronteiras[i]).
+    Uma ordem de culturas que só difere desta depois de fronteiras[i], para
+    todo i < j, e com os mesmos tempos iniciais até o lote j-1, tem as mesmas
+    primeiras passadas nos lotes 0 a j-1 (ver CrpDecoder.decode_relink).
+    """
+
+    def __init__(self, lista_culturas, tempos_ini):
+        self.lista_culturas = list(lista_culturas)
+        self.tempos_ini = list(tempos_ini)
+        self.estados = []
+        self.plantadas = []
+        self.fronteiras = []
+        self.custo = None
+
+    def troca(self, trocas):
+      "Retorna uma cópia da ordem das culturas com as trocas de posições (i, j) aplicadas em sequência"
+      lista_culturas = list(self.lista_culturas)
+      for i, j in trocas:
+        lista_culturas[i], lista_culturas[j] = lista_culturas[j], lista_culturas[i]
+      return lista_culturas
@@ -1,41 +1,149 @@
-import matplotlib.pyplot as plt
+"""
+Usage:
+  drawgraph.py [<results_file>...] [-o <output_file>] [--points <n>] \
+[--max_time <seconds>] [--log] [--show]
+
+  drawgraph.py (-h | --help)
+
+Time-to-target (TTT) analysis: for each results file, draws the empirical
+cumulative distribution of the time to reach the target, i.e., the fraction
+of the runs that reached it within each time, and prints summary statistics
+of the times. Several files are drawn on the same chart, to compare them
+(e.g., `drawgraph.py tests/times*.txt`).
+
+A results file is either the JSON lines output of gettimes.py, whose
+`time_to_target` is used (runs that did not reach the target count as runs,
+so their curve stays below 1), or a text file with one time per line, in
+UTF-8 or, with a byte order mark, UTF-16 (as written by a PowerShell
+redirect of the times printed by gettimes.py).
+
+Options:
+  -o --output_file <arg>    Chart image file [default: ttt.png].
+
+  --points <arg>            Points of the time grid where the distributions
+                            are evaluated [default: 1000].
+
+  --max_time <arg>          Upper limit of the time axis, in seconds.
+                            Defaults to the largest time read.
+
+  --log                     Logarithmic time axis.
+
+  --show                    Also show the chart in a window.
+
+  -h --help                 Produce help message.
+"""
+
+import os
+import sys
+
+import docopt
 import numpy as np
-import math
-
-with open("results.txt", "r", encoding="utf-16") as hd:
-    lines = hd.readlines()
-
-if not lines:
-    print("Failed to open file")
-    exit()
-
-times = []
-for line in lines:
-    times.append(float(line.strip("\n")))
-
-frequency = []
-x = []
-for i in np.arange(0, 100, 0.1):
-    x.append(i)
-    total = 0
-    for time in times:
-        if time <= i:
-            total += 1
-    fraction = total / 100
-    frequency.append(fraction)
-
-fig, ax = plt.subplots()
-
-ax.stairs(frequency, linewidth=2.5)
-ax.grid()
-ax.set_xlim(0, 1000)
-ax.set_ylim(0, 1)
-ax.set_xticks([100, 200, 300, 400, 500, 600, 700, 800, 900])
-ax.set_xticklabels([10, 20, 30, 40, 50, 60, 70, 80, 90])
-ax.set_yticks([0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9])
-ax.set_xlabel("Tempo (s)")
-ax.set_ylabel("Probabilidade")
-
-print(f'Média: {np.mean(times)}')
-print(f'Mediana: {np.median(times)}')
-print(f'Desvio Padrão: {np.std(times)}')
\ No newline at end of file
+
+from crp_trace import read_trace
+
+###############################################################################
+
+def read_times(filename: str) -> tuple:
+    """
+    Returns the times to target read from `filename`, sorted, and the number
+    of runs (which includes the runs that did not reach the target).
+    """
+    if filename.endswith(".jsonl"):
+        values = [record["time_to_target"] for record in read_trace(filename)]
+        times = np.array([t for t in values if t is not None], dtype=float)
+        num_runs = len(values)
+    else:
+        with open(filename, "rb") as hd:
+            bom = hd.read(2)
+        encoding = "utf-16" if bom in (b"\xff\xfe", b"\xfe\xff") else "utf-8"
+        with open(filename, "r", encoding=encoding) as hd:
+            times = np.fromiter((float(line) for line in hd if line.strip()),
+                                dtype=float)
+        num_runs = len(times)
+    times.sort()
+    return times, num_runs
+
+def ttt_cdf(times: np.ndarray, num_runs: int, grid: np.ndarray) -> np.ndarray:
+    """
+    Fraction of the runs that reached the target within each time of `grid`,
+    given the sorted times to target.
+    """
+    return np.searchsorted(times, grid, side="right") / max(num_runs, 1)
+
+def summary(times: np.ndarray, num_runs: int) -> dict:
+    if len(times) == 0:
+        return {"runs": num_runs, "reached": 0}
+    return {"runs": num_runs,
+            "reached": len(times),
+            "mean": float(np.mean(times)),
+            "median": float(np.median(times)),
+            "std": float(np.std(times)),
+            "min": float(times[0]),
+            "p90": float(np.quantile(times, 0.9)),
+            "max": float(times[-1])}
+
+###############################################################################
+
+def main() -> None:
+    args = docopt.docopt(__doc__)
+    filenames = args["<results_file>"] or ["results.txt"]
+    num_points = int(args["--points"])
+
+    results = {}
+    for filename in filenames:
+        times, num_runs = read_times(filename)
+        if num_runs == 0:
+            print(f"{filename}: no runs, skipped")
+            continue
+        results[filename] = (times, num_runs)
+
+    if not results:
+        print("No results to draw")
+        sys.exit(1)
+
+    print(f"{'Arquivo':<24} {'Execuções':>9} {'Atingiu':>7} {'Média':>9} "
+          f"{'Mediana':>9} {'Desvio':>9} {'Mín':>9} {'P90':>9} {'Máx':>9}")
+    for filename, (times, num_runs) in results.items():
+        stats = summary(times, num_runs)
+        line = f"{os.path.basename(filename):<24} {stats['runs']:>9} " \
+               f"{stats['reached']:>7}"
+        if stats["reached"]:
+            for name in ("mean", "median", "std", "min", "p90", "max"):
+                line += f" {stats[name]:>9.3f}"
+        print(line)
+
+    max_time = float(args["--max_time"]) if args["--max_time"] else \
+        max((times[-1] for times, _ in results.values() if len(times)),
+            default=1.0)
+    if args["--log"]:
+        min_time = min((times[0] for times, _ in results.values()
+                        if len(times) and times[0] > 0), default=1e-3)
+        grid = np.geomspace(min_time, max_time, num_points)
+    else:
+        grid = np.linspace(0, max_time, num_points)
+
+    # Imported here: it is slow to import and only needed for the chart.
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    for filename, (times, num_runs) in results.items():
+        ax.step(grid, ttt_cdf(times, num_runs, grid), where="post",
+                linewidth=1.5, label=os.path.basename(filename))
+    if args["--log"]:
+        ax.set_xscale("log")
+    ax.set_xlim(grid[0], grid[-1])
+    ax.set_ylim(0, 1)
+    ax.grid()
+    ax.set_xlabel("Tempo (s)")
+    ax.set_ylabel("Probabilidade")
+    if len(results) > 1:
+        ax.legend()
+    fig.savefig(args["--output_file"])
+    print(f"Chart saved to {args['--output_file']}")
+    if args["--show"]:
+        plt.show()
+
+###############################################################################
+
+if __name__ == "__main__":
+    main()
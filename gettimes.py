@@ -24,15 +24,32 @@
 ###############################################################################
 """
 Usage:
-  main.py -c <config_file> -s <seed> -r <stop_rule> \
--a <stop_arg> -t <max_time> -i <instance_file> [--no_evolution]
-
-  main.py (-h | --help)
+  gettimes.py -c <config_file> -s <seed> -r <stop_rule> \
+-a <stop_arg> -t <max_time> -i <instance_file> [-n <num_seeds>] \
+[-p <processes>] [-o <output_file>] [-w <workers>] [--cache_size <size>] \
+[-l <plots>] [--horizon <slots>] [--num_regular <n>] [--num_green <n>] \
+[--pr_interval <n>] [--ls_interval <n>] [--ls_size <n>] [--prune] \
+[--trace <file>] [--no_evolution]
+
+  gettimes.py (-h | --help)
+
+Runs the optimization once for each seed in [seed, seed + num_seeds). The
+runs are spread over a pool of processes, which load the instance only once.
+As each run finishes, its record (seed, iterations, time to target, best
+cost, ...) is appended to the output file as a JSON line, and its total time
+is printed. Seeds already recorded in the output file are skipped, so an
+interrupted campaign can be resumed by running the same command again. Each
+record holds the settings of its run (instance, sizes, BRKGA parameters, stop
+rule and options), and the runs are refused if the output file has records
+with other settings, so results of different experiments are never mixed.
+
+With --trace, the per-generation records of each run (see main.py) are also
+appended to the trace file, with the seed, when the run finishes.
 
 Options:
   -c --config_file <arg>    Text file with the BRKGA-MP-IPR parameters.
 
-  -s --seed <arg>           Seed for the random number generator.
+  -s --seed <arg>           Seed of the first run.
 
   -r --stop_rule <arg>      Stop rule where:
                             - (G)enerations: number of evolutionary
@@ -45,7 +62,57 @@ Options:
 
   -t --max_time <arg>       Maximum time in seconds.
 
-  -i --instance_file <arg>  Instance file.
+  -i --instance_file <arg>  Instance file: a CSV file, without the .csv
+                            extension, or a binary .npy file written by
+                            convert_instance.py.
+
+  -n --num_seeds <arg>      Number of runs, one per seed [default: 100].
+
+  -p --processes <arg>      Number of runs done at the same time
+                            [default: 1].
+
+  -o --output_file <arg>    JSON lines file with one record per run
+                            [default: times.jsonl].
+
+  -w --workers <arg>        Number of processes used to decode the
+                            chromosomes [default: 1].
+
+  --cache_size <arg>        Capacity of the LRU fitness cache, in number of
+                            decoded crop orders. 0 disables the cache
+                            [default: 0].
+
+  -l --num_plots <arg>      Number of plots to be filled.
+
+  --horizon <arg>           Length of the planting cycle, in time slots.
+
+  --num_regular <arg>       Number of regular crops, which are the first rows
+                            of the instance file.
+
+  --num_green <arg>         Number of green manure crops, which are the last
+                            rows of the instance file.
+
+                            The four options above default to the values
+                            saved in a binary instance or, for a CSV, to 1
+                            plot, 72 slots, 24 regular and 4 green crops.
+
+  --pr_interval <arg>       Number of generations without improvement after
+                            which path relinking is performed, as in main.py.
+                            0 disables it [default: 0].
+
+  --ls_interval <arg>       Number of generations between local searches on
+                            the best chromosomes, as in main.py. 0 disables
+                            it [default: 0].
+
+  --ls_size <arg>           Number of best chromosomes of each population
+                            improved by each local search [default: 1].
+
+  --prune                   Stop decoding offspring and mutants as soon as
+                            they cannot beat the worst elite chromosome. They
+                            get a partial cost, which is a lower bound of the
+                            real one.
+
+  --trace <arg>             File with one record per generation of each run,
+                            as in main.py.
 
   --no_evolution      If supplied, no evolutionary operators are applied. So,
                       the algorithm becomes a simple multi-start algorithm.
@@ -53,19 +120,23 @@ Options:
   -h --help           Produce help message.
 """
 
-from copy import deepcopy
-from datetime import datetime
-from os.path import basename
+import json
+import math
+import multiprocessing
+import os
 import time
 
 import docopt
 
-from brkga_mp_ipr.algorithm import BrkgaMpIpr
-from brkga_mp_ipr.enums import ParsingEnum, Sense
+from brkga_mp_ipr.enums import ParsingEnum, PathRelinkingResult, Sense
 from brkga_mp_ipr.types_io import load_configuration
 
+from crp_brkga import CrpBrkgaMpIpr
 from crp_instance import CrpInstance
 from crp_decoder import CrpDecoder
+from crp_parallel import CrpParallelDecoder
+from crp_stats import CrpStats
+from crp_trace import CrpTrace
 
 ###############################################################################
 # Enumerations and constants
@@ -82,6 +153,297 @@ class StopRule(ParsingEnum):
     TARGET = 1
     IMPROVEMENT = 2
 
+###############################################################################
+# Runs
+###############################################################################
+
+# Instance and parameters shared by all runs of a process. They are set once
+# per process by init_runner().
+_instance = None
+_settings = None
+
+def init_runner(instance: CrpInstance, settings: dict) -> None:
+    global _instance, _settings
+    _instance = instance
+    _settings = settings
+
+def run_seed(seed: int) -> dict:
+    """
+    Runs the optimization with the given seed and returns its record. If
+    the trace is on, the record holds the per-generation records in
+    "trace".
+    """
+    instance = _instance
+    brkga_params = _settings["brkga_params"]
+    stop_rule = _settings["stop_rule"]
+    stop_argument = _settings["stop_argument"]
+    maximum_time = _settings["maximum_time"]
+    num_workers = _settings["num_workers"]
+    cache_size = _settings["cache_size"]
+    pr_interval = _settings["pr_interval"]
+    ls_interval = _settings["ls_interval"]
+    ls_size = _settings["ls_size"]
+    exchange_interval = _settings["exchange_interval"]
+    num_exchange = _settings["num_exchange"]
+
+    # The trace takes the decode counts and timings from the statistics.
+    stats = CrpStats() if _settings["trace"] else None
+    trace = []
+
+    ########################################
+    # Build the BRKGA data structures and initialize
+    ########################################
+
+    # Build a decoder object.
+    if num_workers > 1:
+        decoder = CrpParallelDecoder(instance, num_workers,
+                                     cache_size=cache_size, stats=stats)
+    else:
+        decoder = CrpDecoder(instance, cache_size, stats)
+
+    # Chromosome size is the number of nodes.
+    brkga = CrpBrkgaMpIpr(
+        decoder=decoder,
+        sense=Sense.MINIMIZE,
+        seed=seed,
+        chromosome_size=instance.num_nodes,
+        params=brkga_params,
+        evolutionary_mechanism_on=_settings["perform_evolution"],
+        prune=_settings["prune"]
+    )
+
+    brkga.initialize()
+
+    ########################################
+    # Warm up the script/code
+    ########################################
+
+    warmup_time = decoder.warmup()
+    if stats is not None:
+        stats.reset()
+
+    ########################################
+    # Evolving
+    ########################################
+
+    best_cost = -1
+
+    iteration = 0
+    last_update_time = 0.0
+    last_update_iteration = 0
+    large_offset = 0
+    time_to_target = None
+    path_relink_time = 0.0
+    num_path_relink_calls = 0
+    exchange_time = 0.0
+    num_exchanges = 0
+    local_search_time = 0.0
+    num_local_search_calls = 0
+    run = True
+
+    start_time = time.time()
+    while run:
+        iteration += 1
+
+        if stats is not None:
+            stats.start_generation()
+
+        brkga.evolve()
+
+        if stats is not None:
+            stats.end_evolve()
+
+        # A max_time of 0 would mean no limit.
+        max_time = maximum_time - (time.time() - start_time)
+        if ls_interval > 0 and iteration % ls_interval == 0 and max_time > 0:
+            ls_start_time = time.time()
+            brkga.local_search(ls_size, max_time)
+            local_search_time += time.time() - ls_start_time
+            num_local_search_calls += 1
+
+        if _settings["perform_evolution"] and exchange_interval > 0 and \
+           brkga_params.num_independent_populations > 1 and \
+           iteration % exchange_interval == 0:
+            exchange_start_time = time.time()
+            brkga.exchange_elite(num_exchange)
+            exchange_time += time.time() - exchange_start_time
+            num_exchanges += 1
+
+        fitness = brkga.get_best_fitness()
+        if best_cost == -1 or fitness < best_cost:
+            last_update_time = time.time() - start_time
+            update_offset = iteration - last_update_iteration
+
+            if large_offset < update_offset:
+                large_offset = update_offset
+
+            last_update_iteration = iteration
+            best_cost = fitness
+
+            if stop_rule == StopRule.TARGET and best_cost <= stop_argument:
+                time_to_target = last_update_time
+
+        iter_without_improvement = iteration - last_update_iteration
+
+        # Performs path relinking when the search stalls, if there is time
+        # left (a max_time of 0 would mean no limit).
+        max_time = maximum_time - (time.time() - start_time)
+        if _settings["perform_evolution"] and pr_interval > 0 and \
+           iter_without_improvement > 0 and \
+           iter_without_improvement % pr_interval == 0 and max_time > 0:
+            block_size = math.ceil(brkga_params.alpha_block_size *
+                                   math.sqrt(brkga_params.population_size))
+
+            pr_start_time = time.time()
+            result = brkga.path_relink(
+                brkga_params.pr_type, brkga_params.pr_selection,
+                decoder.distance, brkga_params.pr_number_pairs,
+                brkga_params.pr_minimum_distance, block_size, max_time,
+                brkga_params.pr_percentage)
+            path_relink_time += time.time() - pr_start_time
+            num_path_relink_calls += 1
+
+            fitness = brkga.get_best_fitness()
+            if result == PathRelinkingResult.BEST_IMPROVEMENT and \
+               fitness < best_cost:
+                last_update_time = time.time() - start_time
+                update_offset = iteration - last_update_iteration
+
+                if large_offset < update_offset:
+                    large_offset = update_offset
+
+                last_update_iteration = iteration
+                best_cost = fitness
+
+                if stop_rule == StopRule.TARGET and \
+                   best_cost <= stop_argument:
+                    time_to_target = last_update_time
+
+            iter_without_improvement = iteration - last_update_iteration
+
+        # Closed after the local search and path relinking, whose decodes
+        # are counted apart.
+        if stats is not None:
+            generation = stats.end_generation(iteration,
+                                              brkga.get_best_fitness())
+            values = sorted(brkga.get_fitness_values())
+            record = {
+                "seed": seed,
+                "iteration": iteration,
+                "time": round(time.time() - start_time, 4),
+                "best_cost": best_cost,
+                "generation_best": values[0],
+                "median_fitness": values[len(values) // 2],
+            }
+            for name in ("decodes", "pruned", "evolve_time", "decode_time",
+                         "first_pass_time", "second_pass_time",
+                         "search_decodes", "search_decode_time"):
+                record[name] = round(generation[name], 6)
+            trace.append(record)
+
+        run = not (
+            (time.time() - start_time > maximum_time)
+            or
+            (stop_rule == StopRule.GENERATIONS and iteration == stop_argument)
+            or
+            (stop_rule == StopRule.IMPROVEMENT and
+            iter_without_improvement >= stop_argument)
+            or
+            (stop_rule == StopRule.TARGET and best_cost <= stop_argument)
+        )
+    total_elapsed_time = time.time() - start_time
+
+    if num_workers > 1:
+        decoder.close()
+
+    record = {
+        "seed": seed,
+        "warmup_time": round(warmup_time, 4),
+        "iterations": iteration,
+        "time": round(total_elapsed_time, 4),
+        "time_to_target": (None if time_to_target is None
+                           else round(time_to_target, 4)),
+        "best_cost": best_cost,
+        "last_update_iteration": last_update_iteration,
+        "last_update_time": round(last_update_time, 4),
+        "large_offset": large_offset,
+        "path_relink_time": round(path_relink_time, 4),
+        "path_relink_calls": num_path_relink_calls,
+        "exchange_time": round(exchange_time, 4),
+        "exchange_calls": num_exchanges,
+        "local_search_time": round(local_search_time, 4),
+        "local_search_calls": num_local_search_calls,
+    }
+    if stats is not None:
+        record["trace"] = trace
+    return record
+
+###############################################################################
+
+def run_settings(instance_file: str, instance: CrpInstance,
+                 settings: dict) -> dict:
+    """
+    Returns the settings that identify the runs of an experiment, as stored
+    in each record: the instance and its sizes, the BRKGA-MP-IPR and control
+    parameters, the stop rule and the options that change a run or its times.
+    """
+    brkga_params = {name: value if isinstance(value, (int, float)) else
+                    str(value)
+                    for name, value in vars(settings["brkga_params"]).items()}
+    experiment = {
+        "instance_file": os.path.normpath(instance_file),
+        "num_plots": instance.numero_lotes,
+        "horizon": instance.duracao_plantio,
+        "num_regular": instance.num_culturas_normais,
+        "num_green": instance.num_culturas_verdes,
+        "brkga_params": brkga_params,
+    }
+    for name, value in settings.items():
+        if name == "stop_rule":
+            experiment[name] = value.name
+        elif name not in ("brkga_params", "trace"):
+            experiment[name] = value
+    # As read back from the output file.
+    return json.loads(json.dumps(experiment))
+
+def load_finished_seeds(output_file: str, experiment: dict) -> set:
+    """
+    Returns the seeds already recorded in the output file. A record left
+    incomplete by an interrupted run is dropped from the file. Raises
+    RuntimeError if a record was written with other settings than
+    ``experiment`` (see ``run_settings()``).
+    """
+    if not os.path.exists(output_file):
+        return set()
+
+    with open(output_file, "r", encoding="utf-8") as hd:
+        lines = hd.readlines()
+
+    complete = []
+    for line in lines:
+        if not line.endswith("\n"):
+            break
+        try:
+            complete.append(json.loads(line))
+        except json.JSONDecodeError:
+            break
+
+    if len(complete) < len(lines):
+        with open(output_file, "w", encoding="utf-8") as hd:
+            hd.writelines(lines[:len(complete)])
+
+    for record in complete:
+        settings = record.get("settings", {})
+        if settings != experiment:
+            changed = sorted(name
+                             for name in experiment.keys() | settings.keys()
+                             if settings.get(name) != experiment.get(name))
+            raise RuntimeError(f"{output_file} has runs with other settings "
+                               f"(seed {record['seed']} differs in "
+                               f"{', '.join(changed)}). Use another output "
+                               f"file.")
+
+    return {record["seed"] for record in complete}
 
 ###############################################################################
 
@@ -96,7 +458,7 @@ def main() -> None:
 
     configuration_file = args["--config_file"]
     instance_file = args["--instance_file"]
-    seed = int(args["--seed"])
+    first_seed = int(args["--seed"])
     stop_rule = StopRule(args["--stop_rule"])
 
     if stop_rule == StopRule.TARGET:
@@ -110,97 +472,131 @@ def main() -> None:
         raise RuntimeError(f"Maximum time must be larger than 0.0. "
                            f"Given {maximum_time}.")
 
-    perform_evolution = not args["--no_evolution"]
+    num_seeds = int(args["--num_seeds"])
+    num_processes = int(args["--processes"])
 
-    ########################################
-    # Load config file and show basic info.
-    ########################################
+    if num_seeds < 1 or num_processes < 1:
+        raise RuntimeError(f"Number of seeds and processes must be larger "
+                           f"than 0. Given {num_seeds} and {num_processes}.")
 
-    brkga_params, control_params = load_configuration(configuration_file)
+    output_file = args["--output_file"]
 
-    ########################################
-    # Load instance and adjust BRKGA parameters
-    ########################################
-    for i in range(100):
-        seed = i
-        instance = CrpInstance(instance_file)
-
-        ########################################
-        # Build the BRKGA data structures and initialize
-        ########################################
-
-        # Usually, it is a good idea to set the population size
-        # proportional to the instance size.
-        brkga_params.population_size = min(brkga_params.population_size,
-                                        10 * instance.num_nodes)
-
-        # Build a decoder object.
-        decoder = CrpDecoder(instance)
-
-        # Chromosome size is the number of nodes.
-        brkga = BrkgaMpIpr(
-            decoder=decoder,
-            sense=Sense.MINIMIZE,
-            seed=seed,
-            chromosome_size=instance.num_nodes,
-            params=brkga_params,
-            evolutionary_mechanism_on=perform_evolution
-        )
+    num_workers = int(args["--workers"])
 
-        brkga.initialize()
+    if num_workers < 1:
+        raise RuntimeError(f"Number of workers must be larger than 0. "
+                           f"Given {num_workers}.")
 
-        ########################################
-        # Warm up the script/code
-        ########################################
+    # Pool processes cannot start their own worker pools.
+    if num_processes > 1 and num_workers > 1:
+        raise RuntimeError("Use either several processes (-p) or several "
+                           "decoding workers (-w), not both.")
 
-        bogus_alg = deepcopy(brkga)
-        bogus_alg.evolve(2)
-        bogus_alg.get_best_fitness()
-        bogus_alg.get_best_chromosome()
-        bogus_alg = None
+    cache_size = int(args["--cache_size"])
 
-        ########################################
-        # Evolving
-        ########################################
+    if cache_size < 0:
+        raise RuntimeError(f"Cache size must be non-negative. "
+                           f"Given {cache_size}.")
 
-        best_cost = -1
+    # None means the value of the instance file, checked by CrpInstance.
+    num_plots, horizon, num_regular, num_green = (
+        int(args[name]) if args[name] is not None else None
+        for name in ("--num_plots", "--horizon", "--num_regular",
+                     "--num_green"))
 
-        iteration = 0
-        last_update_time = 0.0
-        last_update_iteration = 0
-        large_offset = 0
-        run = True
+    pr_interval = int(args["--pr_interval"])
 
-        start_time = time.time()
-        while run:
-            iteration += 1
+    if pr_interval < 0:
+        raise RuntimeError(f"Path relinking interval must be non-negative. "
+                           f"Given {pr_interval}.")
 
-            brkga.evolve()
+    ls_interval = int(args["--ls_interval"])
+    ls_size = int(args["--ls_size"])
 
-            fitness = brkga.get_best_fitness()
-            if best_cost == -1 or fitness < best_cost:
-                update_offset = iteration - last_update_iteration
+    if ls_interval < 0 or ls_size < 1:
+        raise RuntimeError(f"Local search interval must be non-negative and "
+                           f"its size positive. Given {ls_interval} and "
+                           f"{ls_size}.")
 
-                if large_offset < update_offset:
-                    large_offset = update_offset
+    trace_file = args["--trace"]
+    perform_evolution = not args["--no_evolution"]
 
-                last_update_iteration = iteration
-                best_cost = fitness
+    ########################################
+    # Load config file and instance
+    ########################################
 
-            iter_without_improvement = iteration - last_update_iteration
+    brkga_params, control_params = load_configuration(configuration_file)
 
-            run = not (
-                (time.time() - start_time > maximum_time)
-                or
-                (stop_rule == StopRule.GENERATIONS and iteration == stop_argument)
-                or
-                (stop_rule == StopRule.IMPROVEMENT and
-                iter_without_improvement >= stop_argument)
-                or
-                (stop_rule == StopRule.TARGET and best_cost <= stop_argument)
-            )
-        total_elapsed_time = time.time() - start_time
-        print(f"{total_elapsed_time:.2f}")
+    instance = CrpInstance(instance_file, numero_lotes=num_plots,
+                           duracao_plantio=horizon,
+                           num_culturas_verdes=num_green,
+                           num_culturas_normais=num_regular)
+
+    # Usually, it is a good idea to set the population size
+    # proportional to the instance size.
+    brkga_params.population_size = min(brkga_params.population_size,
+                                       10 * instance.num_nodes)
+
+    settings = {
+        "brkga_params": brkga_params,
+        "stop_rule": stop_rule,
+        "stop_argument": stop_argument,
+        "maximum_time": maximum_time,
+        "num_workers": num_workers,
+        "cache_size": cache_size,
+        "perform_evolution": perform_evolution,
+        "pr_interval": pr_interval,
+        "ls_interval": ls_interval,
+        "ls_size": ls_size,
+        "exchange_interval": control_params.exchange_interval,
+        "num_exchange": control_params.num_exchange_indivuduals,
+        "prune": args["--prune"],
+        "trace": trace_file is not None,
+    }
+
+    ########################################
+    # Run the seeds not done yet
+    ########################################
+
+    experiment = run_settings(instance_file, instance, settings)
+    finished = load_finished_seeds(output_file, experiment)
+    seeds = [seed for seed in range(first_seed, first_seed + num_seeds)
+             if seed not in finished]
+
+    pool = None
+    if num_processes > 1 and len(seeds) > 1:
+        pool = multiprocessing.Pool(min(num_processes, len(seeds)),
+                                    initializer=init_runner,
+                                    initargs=(instance, settings))
+        records = pool.imap_unordered(run_seed, seeds)
+    else:
+        init_runner(instance, settings)
+        records = map(run_seed, seeds)
+
+    trace = CrpTrace(trace_file, append=True) if trace_file else None
+    try:
+        with open(output_file, "a", encoding="utf-8") as hd:
+            for record in records:
+                # The trace of the run is written before its record: a
+                # trace may get duplicated, but is never lost. If the run
+                # stops between the two, the seed runs again when the
+                # campaign resumes, and its rows (tagged with the seed) are
+                # appended a second time.
+                run_trace = record.pop("trace", None)
+                record["settings"] = experiment
+                if trace is not None:
+                    for generation in run_trace:
+                        trace.write(generation)
+                    trace.flush()
+                hd.write(json.dumps(record) + "\n")
+                hd.flush()
+                print(f"{record['time']:.2f}", flush=True)
+    finally:
+        if trace is not None:
+            trace.close()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
 ###############################################################################
 
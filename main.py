@@ -25,7 +25,15 @@
 """
 Usage:
   main.py -c <config_file> -s <seed> -r <stop_rule> \
--a <stop_arg> -t <max_time> -i <instance_file> [--no_evolution]
+-a <stop_arg> -t <max_time> -i <instance_file> [-w <workers>] \
+[--cache_size <size>] [-l <plots>] [--horizon <slots>] [--num_regular <n>] \
+[--num_green <n>] [--stats <interval>] [--stats_file <file>] \
+[--trace <file>] \
+[--profile <file>] [--profile_top <n>] [--pr_interval <n>] \
+[--ls_interval <n>] [--ls_size <n>] [--prune] [--islands] \
+[--checkpoint <file>] \
+[--checkpoint_interval <seconds>] [--resume <file>] [--solution <file>] \
+[--no_chart] [--no_evolution]
 
   main.py (-h | --help)
 
@@ -45,7 +53,97 @@ Options:
 
   -t --max_time <arg>       Maximum time in seconds.
 
-  -i --instance_file <arg>  Instance file.
+  -i --instance_file <arg>  Instance file: a CSV file, without the .csv
+                            extension, or a binary .npy file written by
+                            convert_instance.py.
+
+  -w --workers <arg>        Number of processes used to decode the
+                            chromosomes [default: 1].
+
+  --cache_size <arg>        Capacity of the LRU fitness cache, in number of
+                            decoded crop orders. 0 disables the cache
+                            [default: 0].
+
+  -l --num_plots <arg>      Number of plots to be filled.
+
+  --horizon <arg>           Length of the planting cycle, in time slots.
+
+  --num_regular <arg>       Number of regular crops, which are the first rows
+                            of the instance file.
+
+  --num_green <arg>         Number of green manure crops, which are the last
+                            rows of the instance file.
+
+                            The four options above default to the values
+                            saved in a binary instance or, for a CSV, to 1
+                            plot, 72 slots, 24 regular and 4 green crops.
+
+  --stats <arg>             Interval, in generations, between the lines with
+                            the decoding statistics. 0 disables them
+                            [default: 0].
+
+  --stats_file <arg>        JSON lines file with the decoding statistics of
+                            each generation. A resumed run appends to it.
+
+  --trace <arg>             File with one record per generation: time, best
+                            cost so far, best and median fitness of the
+                            populations, decodes and timings. CSV if the
+                            name ends with .csv, JSON lines otherwise. It is
+                            written in batches. A resumed run appends to it.
+
+  --profile <arg>           File where the profile of the optimization loop
+                            (not the loading or the warmup) is saved. Uses
+                            cProfile. With several workers, only the parent
+                            process is profiled.
+
+  --profile_top <arg>       Number of functions of crp_decoder.py shown, by
+                            cumulative time, at the end of a profiled run
+                            [default: 20].
+
+  --pr_interval <arg>       Number of generations without improvement after
+                            which path relinking is performed (and then again
+                            after as many generations). Uses the pr_* options
+                            of the configuration file. 0 disables it
+                            [default: 0].
+
+  --ls_interval <arg>       Number of generations between local searches on
+                            the best chromosomes of each population, which
+                            are written back improved. 0 disables it
+                            [default: 0].
+
+  --ls_size <arg>           Number of best chromosomes of each population
+                            improved by each local search [default: 1].
+
+  --solution <arg>          File where the best scheduling is saved: one row
+                            per planted crop if the name ends with .csv,
+                            JSON otherwise (readable by CrpSolucao.carrega).
+
+  --no_chart                Do not draw the best scheduling to result.png.
+                            matplotlib is not even imported, which suits
+                            batch runs.
+
+  --prune                   Stop decoding offspring and mutants as soon as
+                            they cannot beat the worst elite chromosome. They
+                            get a partial cost, which is a lower bound of the
+                            real one.
+
+  --islands                 Evolve each independent population in its own
+                            process, with its own decoder. Elite chromosomes
+                            are exchanged between them every
+                            exchange_interval generations of the
+                            configuration file, as with a single process.
+                            Not combined with -w.
+
+  --checkpoint <arg>        File where the state of the run is saved
+                            periodically, so it can be resumed.
+
+  --checkpoint_interval <arg>  Seconds between checkpoints [default: 60].
+
+  --resume <arg>            Checkpoint file from which an interrupted run is
+                            continued. The other options must be the same as
+                            in the interrupted run, except the stop rule and
+                            its argument, and the maximum time, which counts
+                            the time already spent.
 
   --no_evolution      If supplied, no evolutionary operators are applied. So,
                       the algorithm becomes a simple multi-start algorithm.
@@ -53,19 +151,26 @@ Options:
   -h --help           Produce help message.
 """
 
-from copy import deepcopy
+import cProfile
 from datetime import datetime
+import math
 from os.path import basename
+import pstats
 import time
 
 import docopt
 
-from brkga_mp_ipr.algorithm import BrkgaMpIpr
-from brkga_mp_ipr.enums import ParsingEnum, Sense
+from brkga_mp_ipr.enums import ParsingEnum, PathRelinkingResult, Sense
 from brkga_mp_ipr.types_io import load_configuration
 
+from crp_brkga import CrpBrkgaMpIpr
+from crp_checkpoint import CrpCheckpoint, load_checkpoint
 from crp_instance import CrpInstance
 from crp_decoder import CrpDecoder
+from crp_parallel import CrpParallelDecoder
+from crp_islands import CrpIslands
+from crp_stats import CrpStats
+from crp_trace import CrpTrace
 
 ###############################################################################
 # Enumerations and constants
@@ -110,6 +215,57 @@ def main() -> None:
         raise RuntimeError(f"Maximum time must be larger than 0.0. "
                            f"Given {maximum_time}.")
 
+    num_workers = int(args["--workers"])
+
+    if num_workers < 1:
+        raise RuntimeError(f"Number of workers must be larger than 0. "
+                           f"Given {num_workers}.")
+
+    islands = args["--islands"]
+
+    if islands and num_workers > 1:
+        raise RuntimeError("Islands already decode in their own processes. "
+                           "Use either --islands or -w.")
+
+    cache_size = int(args["--cache_size"])
+
+    if cache_size < 0:
+        raise RuntimeError(f"Cache size must be non-negative. "
+                           f"Given {cache_size}.")
+
+    # None means the value of the instance file, checked by CrpInstance.
+    num_plots, horizon, num_regular, num_green = (
+        int(args[name]) if args[name] is not None else None
+        for name in ("--num_plots", "--horizon", "--num_regular",
+                     "--num_green"))
+
+    stats_interval = int(args["--stats"])
+    stats_file = args["--stats_file"]
+    trace_file = args["--trace"]
+
+    profile_file = args["--profile"]
+    profile_top = int(args["--profile_top"])
+
+    pr_interval = int(args["--pr_interval"])
+
+    if pr_interval < 0:
+        raise RuntimeError(f"Path relinking interval must be non-negative. "
+                           f"Given {pr_interval}.")
+
+    ls_interval = int(args["--ls_interval"])
+    ls_size = int(args["--ls_size"])
+
+    if ls_interval < 0 or ls_size < 1:
+        raise RuntimeError(f"Local search interval must be non-negative and "
+                           f"its size positive. Given {ls_interval} and "
+                           f"{ls_size}.")
+
+    checkpoint_file = args["--checkpoint"]
+    checkpoint_interval = float(args["--checkpoint_interval"])
+    resume_file = args["--resume"]
+
+    solution_file = args["--solution"]
+    draw_chart = not args["--no_chart"]
     perform_evolution = not args["--no_evolution"]
 
     ########################################
@@ -117,6 +273,7 @@ def main() -> None:
     ########################################
 
     brkga_params, control_params = load_configuration(configuration_file)
+    exchange_interval = control_params.exchange_interval
 
     print(f"""------------------------------------------------------
 > Experiment started at {datetime.now()}
@@ -146,7 +303,10 @@ def main() -> None:
 
     print(f"\n[{datetime.now()}] Reading CRP data...")
 
-    instance = CrpInstance(instance_file)
+    instance = CrpInstance(instance_file, numero_lotes=num_plots,
+                           duracao_plantio=horizon,
+                           num_culturas_verdes=num_green,
+                           num_culturas_normais=num_regular)
     print(f"Number of nodes: {instance.num_nodes}")
 
     ########################################
@@ -161,18 +321,47 @@ def main() -> None:
                                        10 * instance.num_nodes)
     print(f"New population size: {brkga_params.population_size}")
 
-    # Build a decoder object.
-    decoder = CrpDecoder(instance)
+    # Instrumentation is off unless asked for. The trace takes the decode
+    # counts and timings from it.
+    stats = None
+    if stats_interval > 0 or stats_file or trace_file:
+        stats = CrpStats(stats_interval, stats_file,
+                         append=bool(resume_file))
+
+    # Build a decoder object. With more than one worker, each worker process
+    # decodes a chunk of the population using its own copy of the instance.
+    # The islands have their own decoders; this one only rebuilds the best
+    # scheduling at the end.
+    if islands:
+        decoder = CrpDecoder(instance)
+    elif num_workers > 1:
+        decoder = CrpParallelDecoder(instance, num_workers,
+                                     cache_size=cache_size, stats=stats)
+    else:
+        decoder = CrpDecoder(instance, cache_size, stats)
 
     # Chromosome size is the number of nodes.
-    brkga = BrkgaMpIpr(
-        decoder=decoder,
-        sense=Sense.MINIMIZE,
-        seed=seed,
-        chromosome_size=instance.num_nodes,
-        params=brkga_params,
-        evolutionary_mechanism_on=perform_evolution
-    )
+    if islands:
+        brkga = CrpIslands(
+            instance=instance,
+            sense=Sense.MINIMIZE,
+            seed=seed,
+            params=brkga_params,
+            cache_size=cache_size,
+            stats=stats,
+            prune=args["--prune"],
+            evolutionary_mechanism_on=perform_evolution
+        )
+    else:
+        brkga = CrpBrkgaMpIpr(
+            decoder=decoder,
+            sense=Sense.MINIMIZE,
+            seed=seed,
+            chromosome_size=instance.num_nodes,
+            params=brkga_params,
+            evolutionary_mechanism_on=perform_evolution,
+            prune=args["--prune"]
+        )
 
     # NOTE: don't forget to initialize the algorithm.
     print(f"\n[{datetime.now()}] Initializing BRKGA data...")
@@ -182,19 +371,16 @@ def main() -> None:
     # Warm up the script/code
     ########################################
 
-    # To make sure we are timing the runs correctly, we run some warmup
-    # iterations with bogus data. Warmup is always recommended for script
-    # languages. Here, we call the most used methods.
+    # To make sure we are timing the runs correctly, we run the decoder hot
+    # paths on a small batch of bogus chromosomes. Warmup is always
+    # recommended for script languages. The algorithm state is not touched.
     print(f"\n[{datetime.now()}] Warming up...")
 
-    bogus_alg = deepcopy(brkga)
-    bogus_alg.evolve(2)
-    # TODO (ceandrade): warm up path relink functions.
-    # bogus_alg.path_relink(brkga_params.pr_type, brkga_params.pr_selection,
-    #              (x, y) -> 1.0, (x, y) -> true, 0, 0.5, 1, 10.0, 1.0)
-    bogus_alg.get_best_fitness()
-    bogus_alg.get_best_chromosome()
-    bogus_alg = None
+    warmup_time = brkga.warmup() if islands else decoder.warmup()
+    print(f"Warmup time: {warmup_time:.2f}")
+
+    if stats is not None:
+        stats.reset()
 
     ########################################
     # Evolving
@@ -209,25 +395,102 @@ def main() -> None:
     last_update_time = 0.0
     last_update_iteration = 0
     large_offset = 0
-    # TODO (ceandrade): enable the following when path relink is ready.
-    # path_relink_time = 0.0
-    # num_path_relink_calls = 0
-    # num_homogenities = 0
-    # num_best_improvements = 0
-    # num_elite_improvements = 0
+    path_relink_time = 0.0
+    num_path_relink_calls = 0
+    exchange_time = 0.0
+    num_exchanges = 0
+    num_homogenities = 0
+    num_best_improvements = 0
+    num_elite_improvements = 0
+    local_search_time = 0.0
+    num_local_search_calls = 0
+    num_local_search_improvements = 0
+    elapsed_time = 0.0
     run = True
 
+    if resume_file:
+        state, counters = load_checkpoint(resume_file)
+        if (counters["instance"], counters["seed"], counters["num_nodes"]) != \
+           (basename(instance_file), seed, instance.num_nodes):
+            raise RuntimeError(f"Checkpoint {resume_file} is from a run of "
+                               f"{counters['instance']} with seed "
+                               f"{counters['seed']}.")
+        brkga.set_state(state)
+
+        iteration = counters["iteration"]
+        best_cost = counters["best_cost"]
+        best_chromosome = counters["best_chromosome"]
+        last_update_time = counters["last_update_time"]
+        last_update_iteration = counters["last_update_iteration"]
+        large_offset = counters["large_offset"]
+        path_relink_time = counters["path_relink_time"]
+        num_path_relink_calls = counters["num_path_relink_calls"]
+        exchange_time = counters["exchange_time"]
+        num_exchanges = counters["num_exchanges"]
+        num_homogenities = counters["num_homogenities"]
+        num_best_improvements = counters["num_best_improvements"]
+        num_elite_improvements = counters["num_elite_improvements"]
+        local_search_time = counters["local_search_time"]
+        num_local_search_calls = counters["num_local_search_calls"]
+        num_local_search_improvements = \
+            counters["num_local_search_improvements"]
+        elapsed_time = counters["elapsed_time"]
+
+        print(f"> Resumed from {resume_file}: iteration {iteration}, "
+              f"cost {best_cost:.0f}, time {elapsed_time:.2f}")
+
+    trace = None
+    if trace_file:
+        trace = CrpTrace(trace_file, append=bool(resume_file))
+
+    checkpoint = None
+    checkpoint_time = 0.0
+    if checkpoint_file:
+        checkpoint = CrpCheckpoint(checkpoint_file, checkpoint_interval)
+
+    profiler = None
+    if profile_file:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
     # Main optimization loop. We evolve one generation at time,
-    # keeping track of all changes during such process.
-    start_time = time.time()
+    # keeping track of all changes during such process. A resumed run
+    # counts the time already spent.
+    start_time = time.time() - elapsed_time
     while run:
         iteration += 1
 
         # Evolves one iteration.
+        if stats is not None:
+            stats.start_generation()
+
         brkga.evolve()
 
+        if stats is not None:
+            stats.end_evolve()
+
+        # Improves the best chromosomes by local search, if there is time
+        # left (a max_time of 0 would mean no limit).
+        max_time = maximum_time - (time.time() - start_time)
+        if ls_interval > 0 and iteration % ls_interval == 0 and max_time > 0:
+            ls_start_time = time.time()
+            num_improved = brkga.local_search(ls_size, max_time)
+            local_search_time += time.time() - ls_start_time
+            num_local_search_calls += 1
+            num_local_search_improvements += num_improved
+
+        # Exchanges elite chromosomes between the populations.
+        if perform_evolution and exchange_interval > 0 and \
+           brkga_params.num_independent_populations > 1 and \
+           iteration % exchange_interval == 0:
+            exchange_start_time = time.time()
+            brkga.exchange_elite(control_params.num_exchange_indivuduals)
+            exchange_time += time.time() - exchange_start_time
+            num_exchanges += 1
+
         # Checks the current results and holds the best.
         fitness = brkga.get_best_fitness()
+
         if best_cost == -1 or fitness < best_cost:
             last_update_time = time.time() - start_time
             update_offset = iteration - last_update_iteration
@@ -242,62 +505,210 @@ def main() -> None:
             print(f"* {iteration} | {best_cost:.0f} | {last_update_time:.2f}")
         # end if
 
-        # TODO (ceandrade): implement path relink calls here.
-        # Please, see Julia version for that.
-
         iter_without_improvement = iteration - last_update_iteration
 
+        # Performs path relinking when the search stalls, if there is time
+        # left (a max_time of 0 would mean no limit).
+        max_time = maximum_time - (time.time() - start_time)
+        if perform_evolution and pr_interval > 0 and \
+           iter_without_improvement > 0 and \
+           iter_without_improvement % pr_interval == 0 and max_time > 0:
+            block_size = math.ceil(brkga_params.alpha_block_size *
+                                   math.sqrt(brkga_params.population_size))
+
+            print(f"> Path relinking | {iteration}", end="", flush=True)
+            pr_start_time = time.time()
+            result = brkga.path_relink(
+                brkga_params.pr_type, brkga_params.pr_selection,
+                decoder.distance, brkga_params.pr_number_pairs,
+                brkga_params.pr_minimum_distance, block_size, max_time,
+                brkga_params.pr_percentage)
+            pr_time = time.time() - pr_start_time
+            path_relink_time += pr_time
+            num_path_relink_calls += 1
+
+            if result == PathRelinkingResult.TOO_HOMOGENEOUS:
+                num_homogenities += 1
+                print(" | too homogeneous", end="")
+            elif result == PathRelinkingResult.NO_IMPROVEMENT:
+                print(" | no improvement", end="")
+            elif result == PathRelinkingResult.ELITE_IMPROVEMENT:
+                num_elite_improvements += 1
+                print(" | elite improvement", end="")
+            elif result == PathRelinkingResult.BEST_IMPROVEMENT:
+                num_best_improvements += 1
+                print(" | best improvement", end="")
+            print(f" | {pr_time:.2f}s")
+
+            fitness = brkga.get_best_fitness()
+            if fitness < best_cost:
+                last_update_time = time.time() - start_time
+                update_offset = iteration - last_update_iteration
+
+                if large_offset < update_offset:
+                    large_offset = update_offset
+
+                last_update_iteration = iteration
+                best_cost = fitness
+                best_chromosome = brkga.get_best_chromosome()
+
+                print(f"* {iteration} | {best_cost:.0f} | "
+                      f"{last_update_time:.2f}")
+
+            iter_without_improvement = iteration - last_update_iteration
+        # end if
+
+        # Closed after the local search and path relinking, whose decodes
+        # are counted apart.
+        if stats is not None:
+            generation = stats.end_generation(iteration,
+                                              brkga.get_best_fitness())
+
+        if trace is not None:
+            values = sorted(brkga.get_fitness_values())
+            record = {
+                "iteration": iteration,
+                "time": round(time.time() - start_time, 4),
+                "best_cost": best_cost,
+                "generation_best": values[0],
+                "median_fitness": values[len(values) // 2],
+            }
+            for name in ("decodes", "pruned", "evolve_time", "decode_time",
+                         "first_pass_time", "second_pass_time",
+                         "search_decodes", "search_decode_time"):
+                record[name] = round(generation[name], 6)
+            trace.write(record)
+
         # Check stop criteria.
         run = not (
             (time.time() - start_time > maximum_time)
             or
-            (stop_rule == StopRule.GENERATIONS and iteration == stop_argument)
+            (stop_rule == StopRule.GENERATIONS and iteration >= stop_argument)
             or
             (stop_rule == StopRule.IMPROVEMENT and
              iter_without_improvement >= stop_argument)
             or
             (stop_rule == StopRule.TARGET and best_cost <= stop_argument)
         )
+
+        # Saves the state; only the snapshot is taken here.
+        if run and checkpoint is not None and checkpoint.due():
+            checkpoint_start_time = time.time()
+            checkpoint.save(brkga.get_state(), {
+                "instance": basename(instance_file),
+                "seed": seed,
+                "num_nodes": instance.num_nodes,
+                "iteration": iteration,
+                "best_cost": best_cost,
+                "best_chromosome": list(best_chromosome),
+                "last_update_time": last_update_time,
+                "last_update_iteration": last_update_iteration,
+                "large_offset": large_offset,
+                "path_relink_time": path_relink_time,
+                "num_path_relink_calls": num_path_relink_calls,
+                "exchange_time": exchange_time,
+                "num_exchanges": num_exchanges,
+                "num_homogenities": num_homogenities,
+                "num_best_improvements": num_best_improvements,
+                "num_elite_improvements": num_elite_improvements,
+                "local_search_time": local_search_time,
+                "num_local_search_calls": num_local_search_calls,
+                "num_local_search_improvements":
+                    num_local_search_improvements,
+                "elapsed_time": time.time() - start_time,
+            })
+            checkpoint_time += time.time() - checkpoint_start_time
     # end while
     total_elapsed_time = time.time() - start_time
+
+    if profiler is not None:
+        profiler.disable()
     total_num_iterations = iteration
 
+    if checkpoint is not None:
+        checkpoint.close()
+
+    # The islands hold the caches.
+    cache = decoder.cache
+    if islands:
+        cache = brkga.get_cache()
+        brkga.close()
+
+    if trace is not None:
+        trace.close()
+
     print(f"[{datetime.now()}] End of optimization\n")
 
     print(f"Total number of iterations: {total_num_iterations}")
     print(f"Last update iteration: {last_update_iteration}")
     print(f"Total optimization time: {total_elapsed_time:.2f}")
+    print(f"Warmup time (not included): {warmup_time:.2f}")
+    if checkpoint is not None:
+        print(f"Checkpoints: {checkpoint.num_saved} saved, "
+              f"{checkpoint.num_skipped} skipped, "
+              f"{checkpoint_time:.2f} s of snapshots")
     print(f"Last update time: {last_update_time:.2f}")
     print(f"Large number of iterations between improvements: {large_offset}")
 
-    # TODO (ceandrade): enable when path relink is ready.
-    # print(f"\nTotal path relink time: {path_relink_time:.2f}")
-    # print(f"\nTotal path relink calls: {num_path_relink_calls}")
-    # print(f"\nNumber of homogenities: {num_homogenities}")
-    # print(f"\nImprovements in the elite set: {num_elite_improvements}")
-    # print(f"\nBest individual improvements: {num_best_improvements}")
+    if cache is not None:
+        print(f"Fitness cache: {cache.summary()}")
+
+    if stats is not None:
+        print(f"Decoding statistics: {stats.summary()}")
+        stats.close()
+
+    if profiler is not None:
+        profiler.dump_stats(profile_file)
+        print(f"\nProfile saved to {profile_file}. "
+              f"Top {profile_top} functions of crp_decoder.py:")
+        # Paths are stripped so the listings of different runs can be diffed.
+        pstats.Stats(profiler).strip_dirs().sort_stats("cumulative") \
+            .print_stats(r"crp_decoder\.py", profile_top)
+
+    print(f"\nTotal path relink time: {path_relink_time:.2f}")
+    print(f"\nTotal path relink calls: {num_path_relink_calls}")
+    print(f"\nTotal elite exchange time: {exchange_time:.2f}")
+    print(f"\nTotal elite exchanges: {num_exchanges}")
+    print(f"\nNumber of homogenities: {num_homogenities}")
+    print(f"\nImprovements in the elite set: {num_elite_improvements}")
+    print(f"\nBest individual improvements: {num_best_improvements}")
+    print(f"\nTotal local search time: {local_search_time:.2f}")
+    print(f"\nTotal local search calls: {num_local_search_calls}")
+    print(f"\nLocal search improvements: {num_local_search_improvements}")
 
     ########################################
     # Extracting the best tour
     ########################################
 
-    decoder.draw_chart(best_chromosome)
+    if draw_chart or solution_file:
+        solution = decoder.solucao(best_chromosome)
+
+    if num_workers > 1:
+        decoder.close()
+
+    if draw_chart:
+        solution.desenha("result.png")
+        print(f"\n% Best scheduling saved")
 
-    print(f"\n% Best scheduling saved")
+    if solution_file:
+        solution.salva(solution_file)
+        print(f"\n% Best scheduling exported to {solution_file}")
 
     print(f"\n% Best cost: {best_cost:.2f}")
 
     print("\n\nInstance,Seed,NumNodes,TotalIterations,TotalTime,"
-          #"TotalPRTime,PRCalls,NumHomogenities,NumPRImprovElite,"
-          #"NumPrImprovBest,"
+          "TotalPRTime,PRCalls,NumHomogenities,NumPRImprovElite,"
+          "NumPrImprovBest,TotalLSTime,LSCalls,NumLSImprov,"
           "LargeOffset,LastUpdateIteration,LastUpdateTime,"
           "Cost")
 
     print(f"{basename(instance_file)},"
           f"{seed},{instance.num_nodes},{total_num_iterations},"
           f"{total_elapsed_time:.2f},"
-          # f"{path_relink_time:.2f},{num_path_relink_calls},"
-          # f"{num_homogenities},{num_elite_improvements},{num_best_improvements},"
+          f"{path_relink_time:.2f},{num_path_relink_calls},"
+          f"{num_homogenities},{num_elite_improvements},{num_best_improvements},"
+          f"{local_search_time:.2f},{num_local_search_calls},"
+          f"{num_local_search_improvements},"
           f"{large_offset},{last_update_iteration},"
           f"{last_update_time:.2f},{best_cost:.0f}")
 